@@ -83,3 +83,17 @@ expense_categories = [
         "description": "Everything else not fitting above categories",
     },
 ]
+
+
+# Single-call extraction: receipt fields + expense_category in one response
+combined_receipt_schema = {
+    "name": "receipt_details_with_category",
+    "schema": {
+        "type": "object",
+        "properties": {
+            **receipt_schema["schema"]["properties"],
+            **category_schema["schema"]["properties"],
+        },
+        "required": category_schema["schema"]["required"],
+    },
+}
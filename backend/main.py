@@ -1,6 +1,9 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routers import users, receipts, query, conversations
+from routers import users, receipts, query, conversations, metrics
+from services.ocr_worker import ocr_pool
+from services import offload
+from services.conversation_service import message_writer
 
 app = FastAPI(title="TrackIt‑AI API")
 
@@ -19,6 +22,24 @@ app.include_router(users.router)
 app.include_router(receipts.router)
 app.include_router(query.router)
 app.include_router(conversations.router)
+app.include_router(metrics.router)
+
+
+@app.on_event("startup")
+async def startup():
+    # warm the OCR worker processes before the first upload arrives
+    await ocr_pool.start()
+    if message_writer is not None:
+        await message_writer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # flush queued chat messages while the DB pool is still up
+    if message_writer is not None:
+        await message_writer.drain()
+    ocr_pool.shutdown()
+    offload.shutdown()
 
 
 @app.get("/")
@@ -16,6 +16,8 @@ CREATE TABLE public.conversations (
   updated_at timestamp with time zone NOT NULL DEFAULT now(),
   message_count integer DEFAULT 0,
   is_active boolean DEFAULT true,
+  context_summary text,
+  summary_through timestamp with time zone,
   CONSTRAINT conversations_pkey PRIMARY KEY (id),
   CONSTRAINT conversations_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(id)
 );
@@ -53,4 +55,123 @@ CREATE TABLE public.users (
   password_hash text NOT NULL,
   name text,
   CONSTRAINT users_pkey PRIMARY KEY (id)
-);
\ No newline at end of file
+);
+-- ── Receipt rollups ─────────────────────────────────────────────────────────
+-- Per-user spend aggregated by day/month × category × merchant. Maintained
+-- incrementally by increment_receipt_rollups() on every saved receipt and
+-- rebuilt from `receipts` by rebuild_receipt_rollups() (scripts/rebuild_rollups.py)
+CREATE TABLE public.receipt_rollups_daily (
+  user_id uuid NOT NULL,
+  day date NOT NULL,
+  expense_category text NOT NULL,
+  merchant_name text NOT NULL,
+  receipt_count integer NOT NULL DEFAULT 0,
+  total_spent numeric NOT NULL DEFAULT 0,
+  updated_at timestamp with time zone NOT NULL DEFAULT now(),
+  CONSTRAINT receipt_rollups_daily_pkey PRIMARY KEY (user_id, day, expense_category, merchant_name),
+  CONSTRAINT receipt_rollups_daily_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(id)
+);
+CREATE TABLE public.receipt_rollups_monthly (
+  user_id uuid NOT NULL,
+  month date NOT NULL,
+  expense_category text NOT NULL,
+  merchant_name text NOT NULL,
+  receipt_count integer NOT NULL DEFAULT 0,
+  total_spent numeric NOT NULL DEFAULT 0,
+  updated_at timestamp with time zone NOT NULL DEFAULT now(),
+  CONSTRAINT receipt_rollups_monthly_pkey PRIMARY KEY (user_id, month, expense_category, merchant_name),
+  CONSTRAINT receipt_rollups_monthly_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(id)
+);
+
+CREATE OR REPLACE FUNCTION public.increment_receipt_rollups(
+  p_user_id uuid,
+  p_transaction_date date,
+  p_expense_category text,
+  p_merchant_name text,
+  p_total_amount numeric
+) RETURNS void
+LANGUAGE sql AS $$
+  INSERT INTO public.receipt_rollups_daily AS r
+    (user_id, day, expense_category, merchant_name, receipt_count, total_spent)
+  VALUES (p_user_id, p_transaction_date, COALESCE(p_expense_category, 'Unknown'),
+          p_merchant_name, 1, COALESCE(p_total_amount, 0))
+  ON CONFLICT (user_id, day, expense_category, merchant_name) DO UPDATE
+    SET receipt_count = r.receipt_count + 1,
+        total_spent = r.total_spent + EXCLUDED.total_spent,
+        updated_at = now();
+
+  INSERT INTO public.receipt_rollups_monthly AS r
+    (user_id, month, expense_category, merchant_name, receipt_count, total_spent)
+  VALUES (p_user_id, date_trunc('month', p_transaction_date)::date,
+          COALESCE(p_expense_category, 'Unknown'), p_merchant_name, 1, COALESCE(p_total_amount, 0))
+  ON CONFLICT (user_id, month, expense_category, merchant_name) DO UPDATE
+    SET receipt_count = r.receipt_count + 1,
+        total_spent = r.total_spent + EXCLUDED.total_spent,
+        updated_at = now();
+$$;
+
+-- Recompute rollups from `receipts` for one user, or everyone when NULL
+CREATE OR REPLACE FUNCTION public.rebuild_receipt_rollups(p_user_id uuid DEFAULT NULL)
+RETURNS integer
+LANGUAGE plpgsql AS $$
+DECLARE
+  rebuilt integer;
+BEGIN
+  DELETE FROM public.receipt_rollups_daily WHERE p_user_id IS NULL OR user_id = p_user_id;
+  DELETE FROM public.receipt_rollups_monthly WHERE p_user_id IS NULL OR user_id = p_user_id;
+
+  INSERT INTO public.receipt_rollups_daily
+    (user_id, day, expense_category, merchant_name, receipt_count, total_spent)
+  SELECT user_id, transaction_date, COALESCE(expense_category, 'Unknown'), merchant_name,
+         COUNT(*), COALESCE(SUM(total_amount), 0)
+  FROM public.receipts
+  WHERE p_user_id IS NULL OR user_id = p_user_id
+  GROUP BY 1, 2, 3, 4;
+  GET DIAGNOSTICS rebuilt = ROW_COUNT;
+
+  INSERT INTO public.receipt_rollups_monthly
+    (user_id, month, expense_category, merchant_name, receipt_count, total_spent)
+  SELECT user_id, date_trunc('month', day)::date, expense_category, merchant_name,
+         SUM(receipt_count), SUM(total_spent)
+  FROM public.receipt_rollups_daily
+  WHERE p_user_id IS NULL OR user_id = p_user_id
+  GROUP BY 1, 2, 3, 4;
+
+  RETURN rebuilt;
+END;
+$$;
+
+-- ── Conversation message persistence ────────────────────────────────────────
+-- Inserts a batch of messages and bumps the conversation's message_count /
+-- updated_at in the same round trip (no COUNT(*) over conversation_messages).
+-- p_messages: [{"id", "role", "content", "metadata", "created_at"}, ...]
+CREATE OR REPLACE FUNCTION public.append_conversation_messages(
+  p_conversation_id uuid,
+  p_messages jsonb
+) RETURNS SETOF public.conversation_messages
+LANGUAGE plpgsql AS $$
+BEGIN
+  RETURN QUERY
+  INSERT INTO public.conversation_messages (id, conversation_id, role, content, metadata, created_at)
+  SELECT COALESCE((m->>'id')::uuid, gen_random_uuid()),
+         p_conversation_id,
+         m->>'role',
+         m->>'content',
+         COALESCE(m->'metadata', '{}'::jsonb),
+         COALESCE((m->>'created_at')::timestamptz, now())
+  FROM jsonb_array_elements(p_messages) WITH ORDINALITY AS t(m, n)
+  ORDER BY n
+  RETURNING *;
+
+  UPDATE public.conversations
+  SET message_count = COALESCE(message_count, 0) + jsonb_array_length(p_messages),
+      updated_at = now()
+  WHERE id = p_conversation_id;
+END;
+$$;
+
+-- ── Message keyset pagination ───────────────────────────────────────────────
+-- Serves newest-first pages and (created_at, id) cursors in both directions
+-- without scanning the conversation's older history.
+CREATE INDEX IF NOT EXISTS conversation_messages_conversation_created_idx
+  ON public.conversation_messages (conversation_id, created_at DESC, id DESC);
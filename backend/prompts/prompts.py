@@ -82,4 +82,17 @@ CREATE TABLE receipt_items (
 
 ### Answer
 Provide ONLY the SQL query (no markdown, no commentary).
-"""
\ No newline at end of file
+"""
+
+# Fold older chat turns into the running conversation summary via Groq
+SUMMARIZE_CONVERSATION_PROMPT = """
+You maintain a running summary of a conversation between a user and an expense-tracking assistant.
+
+Current summary:
+{summary}
+
+New messages to fold in:
+{messages}
+
+Rewrite the summary so it also covers the new messages. Keep the facts later questions may refer to: time periods, categories, merchants, amounts and what the user asked for. At most {max_words} words. Output only the summary.
+"""
@@ -57,3 +57,38 @@ EXAMPLES:
 - "CVS Pharmacy" with medications → "Health & Wellness"
         "Output only the JSON, nothing else."
     )"""
+
+
+def get_combined_extraction_prompt(ocr_text: str, expense_categories) -> str:
+    return f"""
+You are an expert receipt parser and financial expense categorizer.  Return ONLY a JSON object with these keys (no markdown fences):
+
+{{
+  "merchant_name":     string | null,
+  "merchant_address":  string | null,
+  "merchant_phone":    string | null,
+  "merchant_email":    string | null,
+  "transaction_date":  "YYYY-MM-DD" | null,
+  "subtotal_amount":   number | null,
+  "tax_amount":        number | null,
+  "total_amount":      number | null,
+  "payment_method":    string | null,
+  "expense_category":  string,
+  "items": [  // zero or more
+    {{
+      "description": string,
+      "unit_price":  number | null,
+      "quantity":    number | null
+    }}
+  ]
+}}
+
+"expense_category" must be exactly one of these categories, chosen from the
+merchant name and type and the items purchased:
+{json.dumps(expense_categories, indent=2)}
+
+Receipt text:
+{ocr_text}
+
+Output only JSON.
+"""
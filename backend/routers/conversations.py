@@ -7,15 +7,18 @@ from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import json
+from datetime import datetime, timezone
 from services.conversation_service import (
     create_conversation,
     get_conversation,
     get_user_conversations,
-    save_message,
-    get_conversation_messages,
+    save_messages,
+    get_message_page,
+    encode_cursor,
     delete_conversation,
 )
 from services.query_agent import ConversationalQueryEngine
+from services import conversation_summarizer
 from schemas.conversation import (
     ConversationCreate,
     ConversationResponse,
@@ -70,11 +73,23 @@ async def get_conversation_details(conversation_id: str):
 
 @router.get("/{conversation_id}/messages", response_model=MessageList)
 async def get_conversation_message_history(
-    conversation_id: str, limit: int = Query(50, ge=1, le=100)
+    conversation_id: str,
+    limit: int = Query(50, ge=1, le=100),
+    before: Optional[str] = Query(None, description="Cursor: messages older than this"),
+    after: Optional[str] = Query(None, description="Cursor: messages newer than this"),
 ):
-    """Get messages for a conversation"""
+    """
+    Get messages for a conversation in chronological order.
+    Without a cursor this is the newest page; has_more refers to the
+    paging direction (older unless `after` is given).
+    """
+    try:
+        raw_messages, has_more = await get_message_page(conversation_id, limit, before, after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
     try:
-        raw_messages = await get_conversation_messages(conversation_id, limit)
         messages = [
             json.loads(msg) if isinstance(msg, str) else msg for msg in raw_messages
         ]
@@ -88,7 +103,11 @@ async def get_conversation_message_history(
             elif "metadata" not in msg or msg["metadata"] is None:
                 msg["metadata"] = {}
         return MessageList(
-            messages=[MessageResponse(**msg) for msg in messages], total=len(messages)
+            messages=[MessageResponse(**msg) for msg in messages],
+            total=len(messages),
+            before_cursor=encode_cursor(messages[0]) if messages else before,
+            after_cursor=encode_cursor(messages[-1]) if messages else after,
+            has_more=has_more,
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -100,6 +119,7 @@ async def send_chat_message(conversation_id: str, user_id: str, message: ChatMes
     Send a message in a conversation and get AI response
     This is the main conversational endpoint
     """
+    received_at = datetime.now(timezone.utc).isoformat()
     try:
         # Verify conversation exists
         conversation = await get_conversation(conversation_id)
@@ -113,36 +133,41 @@ async def send_chat_message(conversation_id: str, user_id: str, message: ChatMes
 
         if not ai_response.get("success", False):
             error_msg = ai_response.get("error", "Unknown error occurred")
-            await save_message(
-                conversation_id=conversation_id, role="user", content=message.message
-            )
-            # Save error response
-            await save_message(
-                conversation_id=conversation_id,
-                role="assistant",
-                content=f"I'm sorry, I encountered an error: {error_msg}",
-                metadata={"error": True, "original_error": error_msg},
+            # Save the user message and the error response in one batch
+            await save_messages(
+                conversation_id,
+                [
+                    {"role": "user", "content": message.message, "created_at": received_at},
+                    {
+                        "role": "assistant",
+                        "content": f"I'm sorry, I encountered an error: {error_msg}",
+                        "metadata": {"error": True, "original_error": error_msg},
+                    },
+                ],
             )
             raise HTTPException(status_code=500, detail=error_msg)
 
-        # Save user message
-        user_message = await save_message(
-            conversation_id=conversation_id, role="user", content=message.message
+        # Save user message and assistant response in one batch
+        user_message, assistant_message = await save_messages(
+            conversation_id,
+            [
+                {"role": "user", "content": message.message, "created_at": received_at},
+                {
+                    "role": "assistant",
+                    "content": ai_response["answer"],
+                    "metadata": {
+                        "agent": ai_response.get("agent", "unknown"),
+                        "classification": ai_response.get("classification", {}),
+                        "sql_query": ai_response.get("sql"),
+                        "result_count": len(ai_response.get("result", [])),
+                        **ai_response.get("metadata", {}),
+                    },
+                },
+            ],
         )
 
-        # Save assistant response
-        assistant_message = await save_message(
-            conversation_id=conversation_id,
-            role="assistant",
-            content=ai_response["answer"],
-            metadata={
-                "agent": ai_response.get("agent", "unknown"),
-                "classification": ai_response.get("classification", {}),
-                "sql_query": ai_response.get("sql"),
-                "result_count": len(ai_response.get("result", [])),
-                **ai_response.get("metadata", {}),
-            },
-        )
+        # Fold older turns into the running summary off the request path
+        conversation_summarizer.schedule(conversation_id)
 
         return ChatResponse(
             message_id=assistant_message["id"],
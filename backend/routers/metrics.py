@@ -0,0 +1,14 @@
+"""
+metrics router exposing in-process service statistics.
+"""
+
+from fastapi import APIRouter
+from services.metrics import snapshot_all
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("/")
+async def get_metrics():
+    """Counters and timings for caches, OCR engines and LLM calls"""
+    return snapshot_all()
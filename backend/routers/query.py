@@ -6,6 +6,7 @@ from pydantic import BaseModel
 from postgrest.exceptions import APIError
 import re
 from services import query_service
+from services.sql_guard import UnsafeSQLError
 from services.supabase_client import supabase
 
 router = APIRouter(prefix="/query", tags=["query"])
@@ -23,17 +24,14 @@ class QueryResponse(BaseModel):
 async def run_nl_query(req: QueryRequest):
     
     # 1. Validate question
-    if not query_service.validate_question(req.q):
+    if not await query_service.validate_question(req.q):
         raise HTTPException(400, "Invalid question. Please try with another question related to expenses.")    
     
     # 1. NL ➔ SQL
     try:
-        sql = await asyncio.get_running_loop().run_in_executor(
-            None,
-            query_service.get_sql_from_question,
-            req.q,
-            req.user_id
-        )
+        sql = await query_service.get_sql_from_question_async(req.q, req.user_id)
+    except UnsafeSQLError as e:
+        raise HTTPException(422, f"Generated SQL was rejected: {e}")
     except Exception as e:
         raise HTTPException(500, f"Error generating SQL: {e}")
 
@@ -44,20 +42,14 @@ async def run_nl_query(req: QueryRequest):
 
     # 2. Execute SQL
     try:
-        rows = query_service.execute_sql_in_supabase(supabase, clean_sql)
+        rows = await query_service.execute_sql_async(supabase, clean_sql, req.user_id)
         print("executed sql results", rows)
     except Exception as e:
         raise HTTPException(500, f"Database error: {e}") from e
 
     # 3. Explain result via Groq AI
     try:
-        answer = await asyncio.get_running_loop().run_in_executor(
-            None,
-            query_service.explain_query_2,
-            clean_sql,
-            rows,
-            req.q
-        )  
+        answer = await query_service.explain_query_async(clean_sql, rows, req.q)
     except Exception as e:
         raise HTTPException(500, f"Error explaining result: {e}") from e
 
@@ -4,20 +4,22 @@ receipts router for handling receipt extraction, saving, and listing.
 
 import asyncio
 from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Query, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from concurrent.futures import ThreadPoolExecutor
 from typing import List
-from services import ocr_service, llm_service, receipt_service
+from services import ocr_service, llm_service, receipt_service, extraction_pipeline, rollup_service
+from services.category_index import warm_in_background
+from services.ocr_worker import OCRQueueFull, OCRJobTimeout
 from schemas.receipts import (
     ItemOut,
     ReceiptOut,
     ExtractedReceipt,
     SaveReceiptRequest,
     ReceiptList,
+    SpendingSummary,
 )
 
 router = APIRouter(prefix="/receipts", tags=["receipts"])
-executor = ThreadPoolExecutor(max_workers=4)
 
 
 # ── Extract without saving ───────────────────────────────────────────────────
@@ -28,25 +30,52 @@ async def extract_receipt(user_id: str = Form(...), file: UploadFile = File(...)
     except Exception:
         raise HTTPException(400, "Cannot read upload")
 
-    loop = asyncio.get_running_loop()
-    raw_text = await loop.run_in_executor(executor, ocr_service.do_ocr, image_bytes)
+    # load the merchant index while OCR runs, so the lookup is in-memory
+    warm_in_background(user_id)
+    try:
+        raw_text = await ocr_service.do_ocr_async(image_bytes)
+    except OCRQueueFull:
+        raise HTTPException(503, "OCR is busy, please retry", headers={"Retry-After": "5"})
+    except OCRJobTimeout:
+        raise HTTPException(504, "OCR timed out")
     if not raw_text:
         raise HTTPException(400, "No text extracted")
 
-    # parallel LLM calls
-    details_task = asyncio.create_task(llm_service.call_extract_details(raw_text))
-    category_task = asyncio.create_task(llm_service.call_expense_category(raw_text))
-
     try:
-        details, category = await asyncio.gather(details_task, category_task)
+        details = await llm_service.extract_receipt_fields(raw_text, user_id=user_id)
     except Exception as e:
         raise HTTPException(500, f"LLM error: {e}")
 
-    details["expense_category"] = category
     print("details", details)
     return details
 
 
+# ── Extract many receipts, streamed back as NDJSON ──────────────────────────
+@router.post("/extract-batch")
+async def extract_receipts_batch(
+    user_id: str = Form(...), files: List[UploadFile] = File(...)
+):
+    """
+    Run every upload through the pipelined OCR → LLM scheduler.
+    Streams one JSON object per line as each receipt finishes:
+    {"index", "filename", "status": "ok"|"error", "receipt" | "error"}
+    """
+    if len(files) > extraction_pipeline.EXTRACT_BATCH_MAX_FILES:
+        raise HTTPException(
+            413, f"At most {extraction_pipeline.EXTRACT_BATCH_MAX_FILES} files per batch"
+        )
+    try:
+        uploads = [(f.filename, await f.read()) for f in files]
+    except Exception:
+        raise HTTPException(400, "Cannot read upload")
+
+    warm_in_background(user_id)
+    return StreamingResponse(
+        extraction_pipeline.stream_batch(uploads, user_id),
+        media_type="application/x-ndjson",
+    )
+
+
 # ── Save + upload image to S3 + split into two tables ─────────────────═══════
 @router.post("/save", response_model=ReceiptOut)
 async def save_receipt(
@@ -88,6 +117,23 @@ async def list_receipts(
         raise HTTPException(500, str(e))
 
 
+# ── Dashboard spending summary (served from rollups) ───────────────────────
+@router.get("/user/{user_id}/summary", response_model=SpendingSummary)
+async def spending_summary(
+    user_id: str,
+    months: int = Query(12, ge=1, le=60),
+    top_merchants_days: int = Query(90, ge=1, le=3650),
+):
+    try:
+        monthly = await rollup_service.get_monthly_summary(user_id, months)
+        merchants = await rollup_service.get_top_merchants(user_id, days=top_merchants_days)
+        return SpendingSummary(months=monthly, top_merchants=merchants)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+
 # ── Fetch items for a single receipt ────────────────────────────────────────
 @router.get("/{receipt_id}/items", response_model=List[ItemOut])
 async def get_receipt_items(receipt_id: int):
@@ -47,3 +47,8 @@ class ConversationList(BaseModel):
 class MessageList(BaseModel):
     messages: List[MessageResponse]
     total: int
+    # Keyset cursors: pass before_cursor as `before` for older messages,
+    # after_cursor as `after` for newer ones
+    before_cursor: Optional[str] = None
+    after_cursor: Optional[str] = None
+    has_more: bool = False
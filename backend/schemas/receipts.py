@@ -1,6 +1,6 @@
 # ── Pydantic Schemas ─────────────────────────────────────────────────────────
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 
 class ItemOut(BaseModel):
@@ -51,3 +51,15 @@ class SaveReceiptRequest(BaseModel):
 class ReceiptList(BaseModel):
     receipts: List[ReceiptOut]
     total: int
+
+
+class MonthlySpend(BaseModel):
+    month: str
+    receipt_count: int
+    total_spent: float
+    categories: Dict[str, float] = Field(default_factory=dict)
+
+
+class SpendingSummary(BaseModel):
+    months: List[MonthlySpend]
+    top_merchants: List[Dict[str, Any]] = Field(default_factory=list)
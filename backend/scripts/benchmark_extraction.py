@@ -0,0 +1,122 @@
+"""
+Benchmark split (details + category) vs combined receipt extraction.
+
+Runs every input through both RECEIPT_EXTRACTION_MODE variants and reports
+tokens, latency and how often the two modes agree on each field.
+
+Usage (from backend/):
+    python -m scripts.benchmark_extraction receipts/*.jpg ocr_dumps/*.txt
+
+`.txt` files are used as OCR text directly; anything else is OCR'd first.
+"""
+
+import asyncio
+import sys
+import time
+from typing import Any, Dict, List
+
+from services import llm_service, ocr_service
+from services.metrics import get_stats
+
+COMPARED_FIELDS = [
+    "merchant_name",
+    "transaction_date",
+    "subtotal_amount",
+    "tax_amount",
+    "total_amount",
+    "payment_method",
+    "expense_category",
+]
+
+MODE_CALLS = {"split": ["details", "category"], "combined": ["combined"]}
+
+
+def _load_text(path: str) -> str:
+    if path.endswith(".txt"):
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    with open(path, "rb") as f:
+        return ocr_service.do_ocr(f.read())
+
+
+def _tokens(snapshot: Dict[str, Any], mode: str) -> int:
+    return sum(
+        snapshot.get(f"{call}_prompt_tokens", 0) + snapshot.get(f"{call}_completion_tokens", 0)
+        for call in MODE_CALLS[mode]
+    )
+
+
+def _same(a: Any, b: Any) -> bool:
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return abs(a - b) < 0.01
+    if isinstance(a, str) and isinstance(b, str):
+        return a.strip().lower() == b.strip().lower()
+    return a == b
+
+
+async def _run(text: str, mode: str) -> Dict[str, Any]:
+    stats = get_stats("llm_extract")
+    before = _tokens(stats.snapshot(), mode)
+    start = time.perf_counter()
+    result = await llm_service.extract_receipt_fields(text, mode=mode)
+    latency_ms = (time.perf_counter() - start) * 1000
+    return {
+        "result": result,
+        "latency_ms": latency_ms,
+        "tokens": _tokens(stats.snapshot(), mode) - before,
+    }
+
+
+async def main(paths: List[str]):
+    totals = {mode: {"latency_ms": 0.0, "tokens": 0} for mode in MODE_CALLS}
+    agreement = {field: 0 for field in COMPARED_FIELDS + ["item_count"]}
+    runs = 0
+
+    for path in paths:
+        text = _load_text(path)
+        if not text:
+            print(f"{path}: no OCR text, skipped")
+            continue
+        split = await _run(text, "split")
+        combined = await _run(text, "combined")
+        runs += 1
+
+        for mode, run in (("split", split), ("combined", combined)):
+            totals[mode]["latency_ms"] += run["latency_ms"]
+            totals[mode]["tokens"] += run["tokens"]
+
+        diffs = []
+        for field in COMPARED_FIELDS:
+            if _same(split["result"].get(field), combined["result"].get(field)):
+                agreement[field] += 1
+            else:
+                diffs.append(field)
+        if len(split["result"].get("items") or []) == len(combined["result"].get("items") or []):
+            agreement["item_count"] += 1
+        else:
+            diffs.append("item_count")
+
+        print(
+            f"{path}: split {split['latency_ms']:.0f}ms/{split['tokens']} tok, "
+            f"combined {combined['latency_ms']:.0f}ms/{combined['tokens']} tok, "
+            f"differs on: {', '.join(diffs) or '-'}"
+        )
+
+    if not runs:
+        return
+    print(f"\n{runs} receipts")
+    for mode, total in totals.items():
+        print(
+            f"{mode:>9}: avg {total['latency_ms'] / runs:.0f}ms, "
+            f"avg {total['tokens'] / runs:.0f} tokens"
+        )
+    print("field agreement:")
+    for field, agreed in agreement.items():
+        print(f"  {field:<18} {agreed / runs:.0%}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    asyncio.run(main(sys.argv[1:]))
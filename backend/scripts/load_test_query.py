@@ -0,0 +1,97 @@
+"""
+Concurrent load test for /query/ask and the chat endpoint.
+
+Fires `--requests` questions with `--concurrency` in flight and prints
+latency percentiles, so runs against two builds can be compared.
+
+Usage (from backend/, API running):
+    python -m scripts.load_test_query --user-id <uuid> --label before
+    python -m scripts.load_test_query --user-id <uuid> --endpoint chat --label after
+"""
+
+import argparse
+import asyncio
+import time
+from typing import List, Optional
+
+import httpx
+
+QUESTIONS = [
+    "How much did I spend this month?",
+    "Show me all receipts from Starbucks",
+    "What is my total spend on groceries?",
+    "Which merchant did I spend the most at?",
+    "How many receipts did I upload last month?",
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def _one(
+    client: httpx.AsyncClient, args, question: str, conversation_id: Optional[str]
+) -> Optional[float]:
+    start = time.perf_counter()
+    if args.endpoint == "ask":
+        resp = await client.post("/query/ask", json={"q": question, "user_id": args.user_id})
+    else:
+        resp = await client.post(
+            f"/conversations/{conversation_id}/chat",
+            params={"user_id": args.user_id},
+            json={"message": question},
+        )
+    elapsed = (time.perf_counter() - start) * 1000
+    return elapsed if resp.status_code < 500 else None
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=args.base_url, limits=limits, timeout=args.timeout
+    ) as client:
+        conversation_id = None
+        if args.endpoint == "chat":
+            resp = await client.post(
+                "/conversations/", json={"user_id": args.user_id, "title": "load test"}
+            )
+            conversation_id = resp.json()["id"]
+
+        slots = asyncio.Semaphore(args.concurrency)
+
+        async def run(i: int):
+            async with slots:
+                try:
+                    return await _one(client, args, QUESTIONS[i % len(QUESTIONS)], conversation_id)
+                except httpx.HTTPError:
+                    return None
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(run(i) for i in range(args.requests)))
+        wall = time.perf_counter() - started
+
+    latencies = [r for r in results if r is not None]
+    errors = len(results) - len(latencies)
+    print(f"[{args.label}] {args.endpoint}: {len(results)} requests, "
+          f"concurrency {args.concurrency}, {errors} errors, {wall:.1f}s wall")
+    if latencies:
+        print(
+            f"[{args.label}] p50 {percentile(latencies, 50):.0f}ms  "
+            f"p95 {percentile(latencies, 95):.0f}ms  "
+            f"p99 {percentile(latencies, 99):.0f}ms  "
+            f"max {max(latencies):.0f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--user-id", required=True)
+    parser.add_argument("--endpoint", choices=["ask", "chat"], default="ask")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--label", default="run")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,28 @@
+"""
+Rebuild (or backfill) the receipt rollup tables from `receipts`.
+
+Run once after creating the rollup tables, and whenever the rollups may
+have drifted (e.g. increments that failed, receipts edited in the DB).
+
+Usage (from backend/):
+    python -m scripts.rebuild_rollups                    # every user
+    python -m scripts.rebuild_rollups --user-id <uuid>   # one user
+"""
+
+import argparse
+import time
+
+from services import rollup_service
+
+
+def main(args):
+    started = time.perf_counter()
+    rows = rollup_service.rebuild(args.user_id)
+    scope = f"user {args.user_id}" if args.user_id else "all users"
+    print(f"Rebuilt rollups for {scope}: {rows} daily rows in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--user-id", default=None)
+    main(parser.parse_args())
@@ -0,0 +1,211 @@
+"""
+Merchant Category Index
+Learns merchant → expense_category from the `receipts` table so repeat
+merchants can be categorized without an LLM call
+"""
+
+import asyncio
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, Optional, Tuple
+
+from services.metrics import get_stats
+from services.offload import run_blocking
+from services.supabase_client import supabase
+
+CATEGORY_INDEX_ENABLED = os.getenv("CATEGORY_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+# A merchant is answered locally once it has this many receipts and the top
+# category holds at least CATEGORY_INDEX_MIN_SHARE of them
+CATEGORY_INDEX_USER_MIN_COUNT = int(os.getenv("CATEGORY_INDEX_USER_MIN_COUNT", "2"))
+CATEGORY_INDEX_GLOBAL_MIN_COUNT = int(os.getenv("CATEGORY_INDEX_GLOBAL_MIN_COUNT", "5"))
+CATEGORY_INDEX_MIN_SHARE = float(os.getenv("CATEGORY_INDEX_MIN_SHARE", "0.8"))
+CATEGORY_INDEX_MAX_USERS = int(os.getenv("CATEGORY_INDEX_MAX_USERS", "10000"))
+CATEGORY_INDEX_GLOBAL_ROWS = int(os.getenv("CATEGORY_INDEX_GLOBAL_ROWS", "50000"))
+# Only the receipt header is searched for a known merchant name
+HEADER_LINES = 8
+MAX_NAME_WORDS = 4
+
+CORPORATE_SUFFIXES = {"inc", "llc", "ltd", "co", "corp", "pvt", "plc", "gmbh", "store"}
+
+stats = get_stats("category_index")
+
+MerchantIndex = Dict[str, Counter]
+
+
+def normalize_merchant(name: Optional[str]) -> str:
+    """Lowercase, drop punctuation/store numbers and corporate suffixes"""
+    if not name:
+        return ""
+    words = re.sub(r"[^a-z0-9&' ]+", " ", name.lower()).replace("'", "").split()
+    words = [w for w in words if not w.isdigit() and w not in CORPORATE_SUFFIXES]
+    return " ".join(words)
+
+
+def _add(index: MerchantIndex, merchant: Optional[str], category: Optional[str]):
+    key = normalize_merchant(merchant)
+    if key and category:
+        index.setdefault(key, Counter())[category] += 1
+
+
+def _verdict(counts: Optional[Counter], min_count: int) -> Tuple[Optional[str], float]:
+    """(category, confidence) when the merchant is confidently known"""
+    if not counts:
+        return None, 0.0
+    total = sum(counts.values())
+    category, top = counts.most_common(1)[0]
+    confidence = top / total
+    if total >= min_count and confidence >= CATEGORY_INDEX_MIN_SHARE:
+        return category, confidence
+    return None, confidence
+
+
+class CategoryIndex:
+    """Per-user and global merchant → category counts, loaded lazily"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users: "OrderedDict[str, MerchantIndex]" = OrderedDict()
+        self._global: Optional[MerchantIndex] = None
+
+    # ── Loading ──────────────────────────────────────────────────────────────
+    def _load_user(self, user_id: str) -> MerchantIndex:
+        index: MerchantIndex = {}
+        resp = (
+            supabase.table("receipts")
+            .select("merchant_name, expense_category")
+            .eq("user_id", user_id)
+            .execute()
+        )
+        for row in resp.data or []:
+            _add(index, row.get("merchant_name"), row.get("expense_category"))
+        return index
+
+    def _load_global(self) -> MerchantIndex:
+        index: MerchantIndex = {}
+        resp = (
+            supabase.table("receipts")
+            .select("merchant_name, expense_category")
+            .order("created_at", desc=True)
+            .limit(CATEGORY_INDEX_GLOBAL_ROWS)
+            .execute()
+        )
+        for row in resp.data or []:
+            _add(index, row.get("merchant_name"), row.get("expense_category"))
+        return index
+
+    def warm(self, user_id: str):
+        """Load the user's (and, once, the global) index; blocking"""
+        if self._global is None:
+            index = self._load_global()
+            with self._lock:
+                if self._global is None:
+                    self._global = index
+        with self._lock:
+            if user_id in self._users:
+                return
+        index = self._load_user(user_id)
+        with self._lock:
+            self._users[user_id] = index
+            while len(self._users) > CATEGORY_INDEX_MAX_USERS:
+                self._users.popitem(last=False)
+
+    def is_warm(self, user_id: str) -> bool:
+        with self._lock:
+            if user_id in self._users:
+                self._users.move_to_end(user_id)
+                return self._global is not None
+            return False
+
+    # ── Lookups ──────────────────────────────────────────────────────────────
+    def categorize_text(self, user_id: str, ocr_text: str) -> Optional[str]:
+        """Find a known merchant name in the receipt header and categorize it"""
+        header = [normalize_merchant(line) for line in ocr_text.splitlines()[:HEADER_LINES]]
+        with self._lock:
+            user_index = self._users.get(user_id, {})
+            global_index = self._global or {}
+
+        # longest n-gram that names a known merchant wins
+        best: Optional[str] = None
+        for line in header:
+            words = line.split()
+            for size in range(min(MAX_NAME_WORDS, len(words)), 0, -1):
+                for i in range(len(words) - size + 1):
+                    key = " ".join(words[i : i + size])
+                    if len(key) < 3 or (key not in user_index and key not in global_index):
+                        continue
+                    if best is None or len(key) > len(best):
+                        best = key
+        if best is None:
+            stats.incr("misses")
+            return None
+        return self._lookup_key(user_id, best)
+
+    def _lookup_key(self, user_id: str, key: str) -> Optional[str]:
+        with self._lock:
+            user_counts = self._users.get(user_id, {}).get(key)
+            global_counts = (self._global or {}).get(key)
+        category, _ = _verdict(user_counts, CATEGORY_INDEX_USER_MIN_COUNT)
+        if category:
+            stats.incr("hits_user")
+            return category
+        category, _ = _verdict(global_counts, CATEGORY_INDEX_GLOBAL_MIN_COUNT)
+        if category:
+            stats.incr("hits_global")
+            return category
+        stats.incr("ambiguous" if user_counts or global_counts else "misses")
+        return None
+
+    # ── Updates ──────────────────────────────────────────────────────────────
+    def record(self, user_id: str, merchant_name: Optional[str], category: Optional[str]):
+        """Incrementally learn from a newly saved receipt"""
+        with self._lock:
+            if user_id in self._users:
+                _add(self._users[user_id], merchant_name, category)
+            if self._global is not None:
+                _add(self._global, merchant_name, category)
+
+
+category_index = CategoryIndex()
+
+
+_warming: Dict[str, "asyncio.Task[None]"] = {}
+
+
+async def _warm(user_id: str):
+    try:
+        await run_blocking("db", category_index.warm, user_id)
+        stats.incr("warmed")
+    except Exception as e:
+        stats.incr("load_errors")
+        print(f"[Category index] load failed: {getattr(e, 'message', e)}")
+
+
+def warm_in_background(user_id: str):
+    """Start loading the user's index unless it is loaded or loading"""
+    if not CATEGORY_INDEX_ENABLED or not user_id or user_id in _warming or category_index.is_warm(user_id):
+        return
+    task = asyncio.create_task(_warm(user_id))
+    _warming[user_id] = task
+    task.add_done_callback(lambda _: _warming.pop(user_id, None))
+
+
+async def categorize_text(user_id: str, ocr_text: str) -> Optional[str]:
+    """
+    Category of a known merchant from the in-memory index only. A cold user
+    counts as a miss and the index is warmed in the background, so the
+    request path never waits on the receipts scan.
+    """
+    if not CATEGORY_INDEX_ENABLED or not user_id:
+        return None
+    try:
+        if not category_index.is_warm(user_id):
+            stats.incr("cold")
+            warm_in_background(user_id)
+            return None
+        return category_index.categorize_text(user_id, ocr_text)
+    except Exception as e:
+        stats.incr("lookup_errors")
+        print(f"[Category index] lookup failed: {e}")
+        return None
@@ -2,13 +2,57 @@
 Conversation Management Service
 Handles conversation sessions, memory, and context for multi-turn interactions
 """
+import base64
 import json
+import os
+import time
 import uuid
+from collections import OrderedDict
 from datetime import datetime, timezone
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from services.supabase_client import supabase
+from services.message_writer import (
+    CONVERSATION_WRITE_BEHIND,
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_MAX_PENDING,
+    WRITE_BEHIND_MAX_RETRIES,
+    WRITE_BEHIND_WORKERS,
+    MessageWriteBehind,
+)
+from services.llm_gateway import estimate_tokens
+from services.metrics import get_stats
+from services.offload import run_blocking
 from postgrest.exceptions import APIError
 
+# Prompt context: running summary + the newest raw messages that fit the budget
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "800"))
+CONTEXT_MAX_MESSAGES = 10
+
+# Messages read from the DB when rehydrating memory (matches ConversationMemory.max_messages)
+MEMORY_LOAD_MESSAGES = 20
+
+CONVERSATION_CACHE_MAX = int(os.getenv("CONVERSATION_CACHE_MAX", "1000"))
+# Conversations idle longer than this are dropped and reloaded from the DB
+CONVERSATION_CACHE_IDLE_TTL = int(os.getenv("CONVERSATION_CACHE_IDLE_TTL", "900"))
+
+cache_stats = get_stats("conversation_cache")
+context_stats = get_stats("conversation_context")
+
+
+def _tokens(text: str) -> int:
+    return estimate_tokens([{"content": text}], 0)
+
+
+def _parse_ts(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    # naive timestamps can't be compared with aware ones; they're stored as UTC
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
 
 class ConversationMemory:
     """Manages conversation context and memory"""
@@ -17,34 +61,91 @@ class ConversationMemory:
         self.conversation_id = conversation_id
         self.messages: List[Dict[str, Any]] = []
         self.context_summary = ""
+        # timestamp of the newest message folded into context_summary
+        self.summary_through: Optional[str] = None
         self.max_messages = 20  # Keep last 20 messages in memory
+        # built context, reused until the messages or summary change, so a
+        # turn's several prompts build (and count) it once
+        self._context: Optional[str] = None
+    
+    def set_summary(self, summary: str, through: Optional[str]):
+        """Replace the running summary of messages up to `through`"""
+        self.context_summary = summary
+        self.summary_through = through
+        self._context = None
     
-    def add_message(self, role: str, content: str, metadata: Optional[Dict] = None):
+    def add_message(
+        self,
+        role: str,
+        content: str,
+        metadata: Optional[Dict] = None,
+        timestamp: Optional[str] = None,
+    ):
         """Add a message to conversation memory"""
         message = {
             "role": role,
             "content": content,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": timestamp or datetime.now(timezone.utc).isoformat(),
             "metadata": metadata or {}
         }
         self.messages.append(message)
+        self._context = None
         
         # Keep only recent messages to prevent context overflow
         if len(self.messages) > self.max_messages:
             self.messages = self.messages[-self.max_messages:]
     
+    def unsummarized(self) -> List[Dict[str, Any]]:
+        """Messages not yet folded into context_summary"""
+        through = _parse_ts(self.summary_through)
+        if through is None:
+            return list(self.messages)
+        # messages are chronological: everything after the newest one the
+        # summary covers; a timestamp that won't parse goes by list position
+        cut = 0
+        for i, msg in enumerate(self.messages):
+            ts = _parse_ts(msg["timestamp"])
+            if ts is not None and ts <= through:
+                cut = i + 1
+        return self.messages[cut:]
+    
     def get_conversation_context(self) -> str:
-        """Get formatted conversation context for LLM prompts"""
-        if not self.messages:
+        """
+        Get formatted conversation context for LLM prompts: the running
+        summary of older turns plus the newest messages that fit within
+        CONTEXT_TOKEN_BUDGET
+        """
+        if not self.messages and not self.context_summary:
             return ""
+        if self._context is not None:
+            return self._context
+        
+        used = 0
+        header = []
+        if self.context_summary:
+            header.append(f"SUMMARY OF EARLIER CONVERSATION: {self.context_summary}")
+            used += _tokens(header[0])
         
         context_lines = []
-        for msg in self.messages[-10:]:  # Last 10 messages for context
-            role = msg["role"].upper()
-            content = msg["content"]
-            context_lines.append(f"{role}: {content}")
+        for msg in reversed(self.unsummarized()[-CONTEXT_MAX_MESSAGES:]):
+            line = f"{msg['role'].upper()}: {msg['content']}"
+            cost = _tokens(line)
+            if used + cost > CONTEXT_TOKEN_BUDGET:
+                if not context_lines:  # always keep (part of) the newest message
+                    context_lines.append(line[: max(0, CONTEXT_TOKEN_BUDGET - used) * 4])
+                break
+            context_lines.append(line)
+            used += cost
+        context = "\n".join(header + context_lines[::-1])
         
-        return "\n".join(context_lines)
+        # compared with pasting the last 10 raw messages
+        raw = "\n".join(
+            f"{msg['role'].upper()}: {msg['content']}" for msg in self.messages[-CONTEXT_MAX_MESSAGES:]
+        )
+        context_stats.observe("context_tokens", _tokens(context))
+        context_stats.incr("tokens_saved", max(0, _tokens(raw) - _tokens(context)))
+        self._context = context
+        return context
     
     def get_recent_queries(self) -> List[Dict[str, Any]]:
         """Get recent user queries and system responses"""
@@ -55,6 +156,95 @@ class ConversationMemory:
         return recent
 
 
+class ConversationCache:
+    """
+    LRU of live conversations (row + ConversationMemory) with idle-TTL
+    eviction. Only touched from the event loop, so no locking. The cache is
+    per process: writes made by another worker show up after the idle TTL.
+    """
+
+    def __init__(self, max_entries: int, idle_ttl: int):
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        # conversation_id -> {"conversation", "memory", "touched"}
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def _entry(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if now - entry["touched"] > self.idle_ttl:
+            del self._entries[conversation_id]
+            cache_stats.incr("expired")
+            return None
+        entry["touched"] = now
+        self._entries.move_to_end(conversation_id)
+        return entry
+
+    def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._entry(conversation_id)
+        conversation = entry.get("conversation") if entry else None
+        cache_stats.incr("conversation_hits" if conversation else "conversation_misses")
+        return conversation
+
+    def get_memory(self, conversation_id: str) -> Optional[ConversationMemory]:
+        entry = self._entry(conversation_id)
+        memory = entry.get("memory") if entry else None
+        cache_stats.incr("memory_hits" if memory else "memory_misses")
+        return memory
+
+    def put(self, conversation_id: str, **fields: Any):
+        """Set `conversation` and/or `memory` for the conversation"""
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            entry = self._entries[conversation_id] = {}
+        entry.update(fields)
+        entry["touched"] = time.monotonic()
+        self._entries.move_to_end(conversation_id)
+        self._evict()
+
+    def record_message(
+        self,
+        conversation_id: str,
+        role: str,
+        content: str,
+        metadata: Optional[Dict],
+        timestamp: Optional[str] = None,
+    ):
+        """Write-through for a persisted message; cold conversations are left to the DB"""
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return
+        if entry.get("memory") is not None:
+            entry["memory"].add_message(role, content, metadata, timestamp)
+        if entry.get("conversation") is not None:
+            entry["conversation"]["message_count"] = (entry["conversation"].get("message_count") or 0) + 1
+            entry["conversation"]["updated_at"] = datetime.now(timezone.utc).isoformat()
+
+    def update_conversation(self, conversation_id: str, fields: Dict[str, Any]):
+        """Apply a persisted update to the cached conversation row"""
+        entry = self._entries.get(conversation_id)
+        if entry is not None and entry.get("conversation") is not None:
+            entry["conversation"].update(fields)
+
+    def discard(self, conversation_id: str):
+        self._entries.pop(conversation_id, None)
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._entries:
+            oldest_id, oldest = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - oldest["touched"] <= self.idle_ttl:
+                break
+            del self._entries[oldest_id]
+            cache_stats.incr("evictions")
+        cache_stats.set("size", len(self._entries))
+
+
+conversation_cache = ConversationCache(CONVERSATION_CACHE_MAX, CONVERSATION_CACHE_IDLE_TTL)
+
+
 async def create_conversation(user_id: str, title: Optional[str] = None) -> Dict[str, Any]:
     """Create a new conversation session"""
     conversation_id = str(uuid.uuid4())
@@ -70,9 +260,14 @@ async def create_conversation(user_id: str, title: Optional[str] = None) -> Dict
     }
     
     try:
-        resp = supabase.table("conversations").insert(conversation_data).execute()
+        resp = await run_blocking("db", supabase.table("conversations").insert(conversation_data).execute)
         if not resp.data:
             raise RuntimeError("Failed to create conversation")
+        conversation_cache.put(
+            conversation_id,
+            conversation=resp.data[0],
+            memory=ConversationMemory(conversation_id),
+        )
         return resp.data[0]
     except APIError as e:
         raise RuntimeError(f"Database error creating conversation: {e.message}")
@@ -80,17 +275,22 @@ async def create_conversation(user_id: str, title: Optional[str] = None) -> Dict
 
 async def get_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
     """Get conversation by ID"""
+    cached = conversation_cache.get_conversation(conversation_id)
+    if cached is not None:
+        return cached
     try:
-        resp = supabase.table("conversations").select("*").eq("id", conversation_id).single().execute()
-        return resp.data
+        resp = await run_blocking("db", supabase.table("conversations").select("*").eq("id", conversation_id).single().execute)
     except APIError:
         return None
+    if resp.data and resp.data.get("is_active", True):
+        conversation_cache.put(conversation_id, conversation=resp.data)
+    return resp.data
 
 
 async def get_user_conversations(user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
     """Get user's conversation history"""
     try:
-        resp = supabase.table("conversations").select("*").eq("user_id", user_id).eq("is_active", True).order("updated_at", desc=True).limit(limit).execute()
+        resp = await run_blocking("db", supabase.table("conversations").select("*").eq("user_id", user_id).eq("is_active", True).order("updated_at", desc=True).limit(limit).execute)
         return resp.data or []
     except APIError as e:
         raise RuntimeError(f"Database error getting conversations: {e.message}")
@@ -103,64 +303,180 @@ async def save_message(
     metadata: Optional[Dict] = None
 ) -> Dict[str, Any]:
     """Save a message to the conversation"""
-    message_data = {
+    saved = await save_messages(
+        conversation_id, [{"role": role, "content": content, "metadata": metadata}]
+    )
+    return saved[0]
+
+
+def build_message_row(
+    conversation_id: str,
+    role: str,  # 'user', 'assistant', 'system'
+    content: str,
+    metadata: Optional[Dict] = None,
+    created_at: Optional[str] = None,
+) -> Dict[str, Any]:
+    return {
         "id": str(uuid.uuid4()),
         "conversation_id": conversation_id,
-        "role": role,  # 'user', 'assistant', 'system'
+        "role": role,
         "content": content,
         "metadata": json.dumps(metadata or {}),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": created_at or datetime.now(timezone.utc).isoformat(),
     }
-    
+
+
+async def save_messages(
+    conversation_id: str, messages: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    Save several messages (e.g. a user turn and its reply) in one round trip.
+    Each item has role, content and optional metadata / created_at; the
+    append_conversation_messages RPC inserts them in order and increments the
+    conversation's message_count and updated_at atomically.
+    """
+    rows = [
+        build_message_row(
+            conversation_id,
+            m["role"],
+            m["content"],
+            m.get("metadata"),
+            m.get("created_at"),
+        )
+        for m in messages
+    ]
+    # Write-behind: the rows are visible through the memory view right away
+    # and reach the DB in the background
+    if message_writer is not None and message_writer.enqueue(conversation_id, rows):
+        saved = rows
+    else:
+        if message_writer is not None:
+            # queue full: let this conversation's queued rows land first
+            await message_writer.wait_flushed(conversation_id)
+        saved = await _append_rows(conversation_id, rows)
+
+    for m, row in zip(messages, rows):
+        conversation_cache.record_message(
+            conversation_id, m["role"], m["content"], m.get("metadata"), row["created_at"]
+        )
+    return saved
+
+
+async def _append_rows(conversation_id: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     try:
-        # Save message
-        resp = supabase.table("conversation_messages").insert(message_data).execute()
-        if not resp.data:
-            raise RuntimeError("Failed to save message")
-        
-        # Update conversation timestamp and message count
-        await update_conversation_activity(conversation_id)
-        
-        return resp.data[0]
+        resp = await run_blocking(
+            "db",
+            supabase.rpc(
+                "append_conversation_messages",
+                {"p_conversation_id": conversation_id, "p_messages": rows},
+            ).execute,
+        )
     except APIError as e:
         raise RuntimeError(f"Database error saving message: {e.message}")
+    saved_by_id = {str(row["id"]): row for row in resp.data or []}
+    if len(saved_by_id) != len(rows):
+        raise RuntimeError("Failed to save message")
+    return [saved_by_id[row["id"]] for row in rows]
 
 
-async def get_conversation_messages(
-    conversation_id: str, 
-    limit: int = 50
-) -> List[Dict[str, Any]]:
-    """Get messages for a conversation"""
+message_writer = (
+    MessageWriteBehind(
+        _append_rows,
+        workers=WRITE_BEHIND_WORKERS,
+        max_pending=WRITE_BEHIND_MAX_PENDING,
+        batch_size=WRITE_BEHIND_BATCH_SIZE,
+        max_retries=WRITE_BEHIND_MAX_RETRIES,
+        # the cached memory still holds the lost rows; reload it from the DB
+        on_drop=lambda conversation_id, _rows: conversation_cache.discard(conversation_id),
+    )
+    if CONVERSATION_WRITE_BEHIND
+    else None
+)
+
+
+def encode_cursor(message: Dict[str, Any]) -> str:
+    """Opaque keyset cursor for a message: its (created_at, id)"""
+    raw = f"{message['created_at']}|{message['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """(created_at, id) from a cursor; raises ValueError if malformed"""
     try:
-        resp = supabase.table("conversation_messages").select("*").eq("conversation_id", conversation_id).order("created_at", desc=False).limit(limit).execute()
-        return resp.data or []
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, message_id = raw.split("|", 1)
+        datetime.fromisoformat(created_at)
+        return created_at, str(uuid.UUID(message_id))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+async def get_message_page(
+    conversation_id: str,
+    limit: int = 50,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    A page of messages in chronological order plus whether more exist in
+    the paging direction. Keyset on (created_at, id): `before` pages back
+    from a cursor, `after` pages forward; with neither, the newest page.
+    """
+    if before and after:
+        raise ValueError("Pass either before or after, not both")
+    forward = after is not None
+    query = supabase.table("conversation_messages").select("*").eq("conversation_id", conversation_id)
+    if before or after:
+        created_at, message_id = decode_cursor(before or after)
+        op = "gt" if forward else "lt"
+        query = query.or_(
+            f'created_at.{op}."{created_at}",'
+            f'and(created_at.eq."{created_at}",id.{op}.{message_id})'
+        )
+    query = (
+        query.order("created_at", desc=not forward)
+        .order("id", desc=not forward)
+        .limit(limit + 1)  # one extra row tells whether there is more
+    )
+    try:
+        resp = await run_blocking("db", query.execute)
     except APIError as e:
         raise RuntimeError(f"Database error getting messages: {e.message}")
+    rows = resp.data or []
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return (rows if forward else rows[::-1]), has_more
 
 
-async def update_conversation_activity(conversation_id: str):
-    """Update conversation's last activity timestamp"""
-    try:
-        # Get current message count
-        msg_count_resp = supabase.table("conversation_messages").select("id", count="exact").eq("conversation_id", conversation_id).execute()
-        message_count = msg_count_resp.count or 0
-        
-        # Update conversation
-        update_data = {
-            "updated_at": datetime.now(timezone.utc).isoformat(),
-            "message_count": message_count
-        }
-        supabase.table("conversations").update(update_data).eq("id", conversation_id).execute()
-    except APIError:
-        pass  # Non-critical update
+async def get_conversation_messages(
+    conversation_id: str, 
+    limit: int = 50,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Get messages for a conversation (the newest `limit` by default)"""
+    messages, _ = await get_message_page(conversation_id, limit, before, after)
+    return messages
 
 
 async def load_conversation_memory(conversation_id: str) -> ConversationMemory:
-    """Load conversation memory from database"""
+    """Load conversation memory, from the live cache or else the database"""
+    memory = conversation_cache.get_memory(conversation_id)
+    if memory is not None:
+        return memory
     memory = ConversationMemory(conversation_id)
     
-    # Load recent messages
-    messages = await get_conversation_messages(conversation_id)
+    conversation = await get_conversation(conversation_id)
+    if conversation:
+        memory.set_summary(conversation.get("context_summary") or "", conversation.get("summary_through"))
+    
+    # Load the newest messages, plus any still queued for write-behind
+    messages = await get_conversation_messages(conversation_id, limit=MEMORY_LOAD_MESSAGES)
+    if message_writer is not None:
+        stored = {str(msg.get("id")) for msg in messages}
+        messages += [
+            row for row in message_writer.pending(conversation_id) if row["id"] not in stored
+        ]
     for msg in messages:
         metadata = {}
         if msg.get("metadata"):
@@ -172,16 +488,29 @@ async def load_conversation_memory(conversation_id: str) -> ConversationMemory:
         memory.add_message(
             role=msg["role"],
             content=msg["content"],
-            metadata=metadata
+            metadata=metadata,
+            timestamp=msg.get("created_at"),
         )
     
+    conversation_cache.put(conversation_id, memory=memory)
     return memory
 
 
+async def save_context_summary(conversation_id: str, summary: str, through: str):
+    """Persist the running summary so it isn't recomputed on a cold load"""
+    update_data = {"context_summary": summary, "summary_through": through}
+    try:
+        await run_blocking("db", supabase.table("conversations").update(update_data).eq("id", conversation_id).execute)
+    except APIError as e:
+        raise RuntimeError(f"Database error saving summary: {e.message}")
+    conversation_cache.update_conversation(conversation_id, update_data)
+
+
 async def delete_conversation(conversation_id: str):
     """Soft delete a conversation"""
     try:
-        supabase.table("conversations").update({"is_active": False}).eq("id", conversation_id).execute()
+        await run_blocking("db", supabase.table("conversations").update({"is_active": False}).eq("id", conversation_id).execute)
+        conversation_cache.discard(conversation_id)
     except APIError as e:
         raise RuntimeError(f"Database error deleting conversation: {e.message}")
 
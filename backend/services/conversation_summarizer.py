@@ -0,0 +1,70 @@
+"""
+Conversation Summarizer
+Folds older chat turns into a rolling summary so prompt context stays
+bounded: messages beyond the newest CONTEXT_WINDOW_MESSAGES are summarized
+in the background after a turn is saved, and the summary is persisted on
+the conversation row for cold loads.
+"""
+
+import asyncio
+import os
+from typing import Dict
+
+from prompts.prompts import SUMMARIZE_CONVERSATION_PROMPT
+from services import llm_gateway
+from services.conversation_service import conversation_cache, save_context_summary
+from services.metrics import get_stats
+
+CONVERSATION_SUMMARY_ENABLED = os.getenv("CONVERSATION_SUMMARY_ENABLED", "true").lower() in ("1", "true", "yes")
+SUMMARY_MODEL = "llama-3.1-8b-instant"
+# Newest messages always kept verbatim
+CONTEXT_WINDOW_MESSAGES = int(os.getenv("CONTEXT_WINDOW_MESSAGES", "6"))
+# Wait for this many older messages before paying for a summary call
+SUMMARY_MIN_BATCH = int(os.getenv("SUMMARY_MIN_BATCH", "4"))
+SUMMARY_MAX_WORDS = 120
+
+stats = get_stats("conversation_summary")
+
+_running: Dict[str, "asyncio.Task[None]"] = {}
+
+
+async def summarize(conversation_id: str):
+    """Fold the conversation's older unsummarized messages into its summary"""
+    memory = conversation_cache.get_memory(conversation_id)
+    if memory is None:
+        return
+    older = memory.unsummarized()[:-CONTEXT_WINDOW_MESSAGES]
+    if len(older) < SUMMARY_MIN_BATCH:
+        return
+
+    prompt = SUMMARIZE_CONVERSATION_PROMPT.format(
+        summary=memory.context_summary or "(none)",
+        messages="\n".join(f"{msg['role'].upper()}: {msg['content']}" for msg in older),
+        max_words=SUMMARY_MAX_WORDS,
+    )
+    try:
+        resp = await llm_gateway.chat_completion(
+            model=SUMMARY_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.1,
+            max_completion_tokens=SUMMARY_MAX_WORDS * 2,
+        )
+        summary = resp.choices[0].message.content.strip()
+        through = older[-1]["timestamp"]
+        memory.set_summary(summary, through)
+        await save_context_summary(conversation_id, summary, through)
+    except Exception as e:
+        stats.incr("errors")
+        print(f"[Summarizer] {conversation_id}: {e}")
+        return
+    stats.incr("runs")
+    stats.incr("messages_folded", len(older))
+
+
+def schedule(conversation_id: str):
+    """Summarize in the background unless a run is already in flight"""
+    if not CONVERSATION_SUMMARY_ENABLED or conversation_id in _running:
+        return
+    task = asyncio.create_task(summarize(conversation_id))
+    _running[conversation_id] = task
+    task.add_done_callback(lambda _: _running.pop(conversation_id, None))
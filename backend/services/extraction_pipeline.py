@@ -0,0 +1,90 @@
+"""
+Batch Receipt Extraction Pipeline
+Schedules many receipts through OCR → LLM so that OCR of one receipt
+overlaps the LLM calls of another, streaming results as they finish
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from services import ocr_service, llm_service
+from services.metrics import get_stats
+from services.ocr_worker import OCRQueueFull
+from schemas.receipts import ExtractedReceipt
+
+# Per-stage concurrency; provider limits live with the providers
+# (MISTRAL_MAX_CONCURRENCY in ocr_service, Groq limits in llm_gateway)
+EXTRACT_BATCH_MAX_FILES = int(os.getenv("EXTRACT_BATCH_MAX_FILES", "50"))
+EXTRACT_OCR_CONCURRENCY = int(os.getenv("EXTRACT_OCR_CONCURRENCY", "4"))
+EXTRACT_LLM_CONCURRENCY = int(os.getenv("EXTRACT_LLM_CONCURRENCY", "4"))
+OCR_BUSY_RETRIES = 3
+
+stats = get_stats("extract_batch")
+
+_ocr_stage = asyncio.Semaphore(EXTRACT_OCR_CONCURRENCY)
+_llm_stage = asyncio.Semaphore(EXTRACT_LLM_CONCURRENCY)
+
+
+async def _ocr_with_retry(image_bytes: bytes) -> str:
+    # A batch shouldn't fail just because single-shot uploads filled the pool
+    for attempt in range(OCR_BUSY_RETRIES):
+        try:
+            return await ocr_service.do_ocr_async(image_bytes)
+        except OCRQueueFull:
+            if attempt == OCR_BUSY_RETRIES - 1:
+                raise
+            await asyncio.sleep(0.5 * (attempt + 1))
+    return ""
+
+
+async def _process_one(
+    index: int, filename: str, image_bytes: bytes, user_id: str
+) -> Dict[str, Any]:
+    """Run one receipt through both stages and return its NDJSON record"""
+    record: Dict[str, Any] = {"index": index, "filename": filename}
+    started = time.perf_counter()
+    try:
+        async with _ocr_stage:
+            stage_start = time.perf_counter()
+            raw_text = await _ocr_with_retry(image_bytes)
+            stats.observe("ocr_stage_ms", (time.perf_counter() - stage_start) * 1000)
+        if not raw_text:
+            raise ValueError("No text extracted")
+
+        async with _llm_stage:
+            stage_start = time.perf_counter()
+            details = await llm_service.extract_receipt_fields(raw_text, user_id=user_id)
+            stats.observe("llm_stage_ms", (time.perf_counter() - stage_start) * 1000)
+
+        record["status"] = "ok"
+        record["receipt"] = ExtractedReceipt.parse_obj(details).dict()
+        stats.incr("succeeded")
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e)
+        stats.incr("failed")
+    stats.observe("receipt_ms", (time.perf_counter() - started) * 1000)
+    return record
+
+
+async def stream_batch(
+    uploads: List[Tuple[str, bytes]], user_id: str
+) -> AsyncIterator[str]:
+    """Yield one NDJSON line per receipt, in completion order"""
+    stats.incr("batches")
+    stats.incr("receipts", len(uploads))
+    tasks = [
+        asyncio.create_task(_process_one(i, filename, data, user_id))
+        for i, (filename, data) in enumerate(uploads)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            record = await next_done
+            yield json.dumps(record) + "\n"
+    finally:
+        # client went away: don't keep burning OCR/LLM quota
+        for task in tasks:
+            task.cancel()
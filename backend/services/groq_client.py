@@ -1,7 +1,21 @@
-from groq import Groq
+from groq import Groq, AsyncGroq
+import httpx
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-groqClient = Groq(api_key=os.getenv("GROQ_API_KEY"))
\ No newline at end of file
+groqClient = Groq(api_key=os.getenv("GROQ_API_KEY"))
+
+# Async client on a pooled keep-alive HTTP connection (see services/llm_gateway.py)
+GROQ_HTTP_MAX_CONNECTIONS = int(os.getenv("GROQ_HTTP_MAX_CONNECTIONS", "32"))
+asyncGroqClient = AsyncGroq(
+    api_key=os.getenv("GROQ_API_KEY"),
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=GROQ_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=GROQ_HTTP_MAX_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    ),
+)
@@ -0,0 +1,335 @@
+"""
+Intent Compiler
+Recognizes the common expense question shapes (totals, counts, category and
+monthly breakdowns, top merchants/items, receipt listings) with their
+date-range / merchant / category slots and compiles them straight to SQL,
+so only the long tail has to go through SQLCoder
+"""
+
+import os
+import re
+import time
+import uuid
+from typing import Callable, Dict, Optional, Tuple
+
+from constants.schemas import expense_categories
+from services.metrics import get_stats
+
+INTENT_COMPILER_ENABLED = os.getenv("INTENT_COMPILER_ENABLED", "true").lower() in ("1", "true", "yes")
+LIST_LIMIT = 50
+DEFAULT_TOP_N = 5
+MAX_TOP_N = 50
+MAX_MERCHANT_WORDS = 4
+# A merchant slot containing any of these is a phrase, not a store name
+MERCHANT_STOP_WORDS = {"and", "or", "my", "our", "the", "a", "an", "to", "for", "in", "on", "during", "trip"}
+# Qualifiers trailing a merchant name ("at target including tax")
+MERCHANT_QUALIFIERS = {"including", "incl", "with", "plus", "tax", "taxes", "only", "total", "before", "after"}
+
+stats = get_stats("intent_compiler")
+
+# Words that change the meaning beyond what the shapes below express
+UNSUPPORTED_WORDS = re.compile(
+    r"\b(average|avg|mean|median|compare|compared|versus|vs|except|excluding|without|not|"
+    r"more than|less than|over \$|under|above|below|between|per day|per week|each day|"
+    r"trend|trends|why|should|recommend|predict|budget|save)\b"
+)
+
+# lowercase term -> category name from constants.schemas.expense_categories
+CATEGORY_TERMS: Dict[str, str] = {
+    **{c["category"].lower(): c["category"] for c in expense_categories if c["category"] != "Other"},
+    "grocery": "Groceries",
+    "food": "Dining",
+    "restaurants": "Dining",
+    "restaurant": "Dining",
+    "eating out": "Dining",
+    "transport": "Transportation",
+    "bills": "Utilities",
+    "health": "Health & Wellness",
+    "wellness": "Health & Wellness",
+    "health and wellness": "Health & Wellness",
+    "office": "Office Supplies",
+}
+_CATEGORY_ALT = "|".join(sorted((re.escape(t) for t in CATEGORY_TERMS), key=len, reverse=True))
+
+MONTHS = {
+    m: i + 1
+    for i, m in enumerate(
+        ["january", "february", "march", "april", "may", "june", "july",
+         "august", "september", "october", "november", "december"]
+    )
+}
+
+_PREP = r"(?:\b(?:in|for|from|during|over|since|within|of)\s+)?(?:the\s+)?"
+_UNITS = {"day": "day", "days": "day", "week": "week", "weeks": "week",
+          "month": "month", "months": "month", "year": "year", "years": "year"}
+
+WEEK = "date_trunc('week', CURRENT_DATE)"
+MONTH = "date_trunc('month', CURRENT_DATE)"
+YEAR = "date_trunc('year', CURRENT_DATE)"
+
+# Fixed relative ranges as (lower bound, exclusive upper bound) expressions
+FIXED_RANGES: Dict[str, Tuple[str, Optional[str]]] = {
+    "today": ("CURRENT_DATE", "CURRENT_DATE + 1"),
+    "yesterday": ("CURRENT_DATE - 1", "CURRENT_DATE"),
+    "this week": (WEEK, None),
+    "last week": (f"{WEEK} - INTERVAL '1 week'", WEEK),
+    "this month": (MONTH, None),
+    "last month": (f"{MONTH} - INTERVAL '1 month'", MONTH),
+    "this year": (YEAR, None),
+    "last year": (f"{YEAR} - INTERVAL '1 year'", YEAR),
+    "past week": ("CURRENT_DATE - 7", None),
+    "past month": ("CURRENT_DATE - INTERVAL '1 month'", None),
+    "past year": ("CURRENT_DATE - INTERVAL '1 year'", None),
+}
+
+FIXED_RANGE_RE = re.compile(_PREP + r"\b(" + "|".join(FIXED_RANGES) + r")\b")
+ROLLING_RANGE_RE = re.compile(
+    _PREP + r"\b(?:last|past|previous)\s+(\d{1,4})\s+(days?|weeks?|months?|years?)\b"
+)
+MONTH_RANGE_RE = re.compile(
+    _PREP + r"\b(" + "|".join(MONTHS) + r")(?:\s+(20\d\d))?\b"
+)
+YEAR_RANGE_RE = re.compile(r"(?:\b(?:in|for|from|during|of)\s+)\b(20\d\d)\b")
+
+CATEGORY_SLOT_RES = [
+    re.compile(r"\b(?:on|for)\s+(?:my\s+)?(" + _CATEGORY_ALT + r")(?:\s+category)?\b"),
+    re.compile(r"\bin\s+(?:the\s+)?(" + _CATEGORY_ALT + r")\s+category\b"),
+    # "grocery spending", "dining receipts": keep the noun, drop the term
+    re.compile(r"\b(" + _CATEGORY_ALT + r")\s+(?=spend|spending|expenses?|receipts|purchases)"),
+]
+MERCHANT_SLOT_RE = re.compile(r"\b(?:at|from)\s+([a-z0-9&'.\- ]+)$")
+
+# Shapes are matched against the question once slots are removed
+SHAPES: Dict[str, re.Pattern] = {
+    "total": re.compile(
+        r"(?:how much (?:money )?(?:did|have|do) i (?:spend|spent)"
+        r"|(?:what is|whats|show(?: me)?|get) (?:my )?total (?:spend|spending|spent|expenses?)"
+        r"|(?:my )?total (?:spend|spending|spent|expenses?)"
+        r"|how much (?:have i|did i) spent"
+        r"|(?:what is |whats )?(?:my )?(?:spend|spending))(?: in total| total| so far)?"
+    ),
+    "count": re.compile(
+        r"how many (?:receipts|purchases|transactions)"
+        r"(?: (?:do|did|have) i(?: have| upload(?:ed)?| scan(?:ned)?| made| make| got)?)?"
+    ),
+    "by_category": re.compile(
+        r"(?:(?:show(?: me)?|what is|whats) )?(?:my )?"
+        r"(?:(?:spend|spending|expenses?) (?:broken down )?(?:by|per) category"
+        r"|(?:spending |expense )?breakdown by category"
+        r"|how much did i spend (?:on each|per|by) category)"
+    ),
+    "by_month": re.compile(
+        r"(?:(?:show(?: me)?|what is|whats) )?(?:my )?"
+        r"(?:monthly (?:spend|spending|expenses?)|(?:spend|spending|expenses?) (?:by|per) month)"
+    ),
+    "top_merchants": re.compile(
+        r"(?:(?:show(?: me)?|what are|list) )?(?:my )?top(?: (?P<n>\d{1,2}))? merchants"
+        r"|which merchants? (?:did|do) i spend (?:the )?most (?:at|with)"
+        r"|where (?:did|do) i spend (?:the )?most(?: money)?"
+    ),
+    "top_items": re.compile(
+        r"(?:(?:show(?: me)?|what are|list) )?(?:my )?(?:top|most purchased)(?: (?P<n>\d{1,2}))? items"
+        r"|what (?:items )?(?:did|do) i buy (?:the )?most"
+    ),
+    "list": re.compile(
+        r"(?:show|list|get|find|display)(?: me)?(?: all)?(?: of)?(?: my)? receipts"
+    ),
+}
+
+# Slots each shape can take; anything else falls back to SQLCoder
+SHAPE_SLOTS = {
+    "total": {"date", "category", "merchant"},
+    "count": {"date", "category", "merchant"},
+    "by_category": {"date"},
+    "by_month": {"date", "category", "merchant"},
+    "top_merchants": {"date", "category"},
+    "top_items": {"date", "category", "merchant"},
+    "list": {"date", "category", "merchant"},
+}
+
+
+def _normalize(question: str) -> str:
+    text = question.lower().replace("what's", "whats").replace("&", " and ")
+    text = re.sub(r"[^a-z0-9$'.\- ]+", " ", text)
+    # drop sentence dots; keep decimals and dots inside names (amazon.com)
+    text = re.sub(r"(?<![a-z0-9])\.|\.(?![a-z0-9])", " ", text)
+    return " ".join(text.split())
+
+
+def _strip(text: str, match: re.Match) -> str:
+    return " ".join((text[: match.start()] + " " + text[match.end():]).split())
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _like_pattern(value: str) -> str:
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return _quote(f"%{escaped}%")
+
+
+def _extract_date(text: str) -> Tuple[str, Optional[Tuple[str, Optional[str]]]]:
+    """Remove one date phrase; returns (rest, (lower, upper)) or (text, None)"""
+    found = []
+    m = FIXED_RANGE_RE.search(text)
+    if m:
+        found.append((m, FIXED_RANGES[m.group(1)]))
+    m = ROLLING_RANGE_RE.search(text)
+    if m:
+        n, unit = int(m.group(1)), _UNITS[m.group(2)]
+        lower = f"CURRENT_DATE - {n}" if unit == "day" else f"CURRENT_DATE - INTERVAL '{n} {unit}'"
+        found.append((m, (lower, None)))
+    m = MONTH_RANGE_RE.search(text)
+    if m and m.group(1) == "may" and not m.group(2) and not m.group(0).startswith("in "):
+        m = None  # "may" is only a month in "in may" / "may 2024"
+    if m:
+        year = m.group(2) or "EXTRACT(YEAR FROM CURRENT_DATE)::int"
+        start = f"make_date({year}, {MONTHS[m.group(1)]}, 1)"
+        found.append((m, (start, f"{start} + INTERVAL '1 month'")))
+    m = YEAR_RANGE_RE.search(text)
+    if m and not MONTH_RANGE_RE.search(text):
+        start = f"make_date({m.group(1)}, 1, 1)"
+        found.append((m, (start, f"{start} + INTERVAL '1 year'")))
+
+    if not found:
+        return text, None
+    if len(found) > 1:
+        raise ValueError("more than one date range")
+    match, bounds = found[0]
+    return _strip(text, match), bounds
+
+
+def _extract_category(text: str) -> Tuple[str, Optional[str]]:
+    for pattern in CATEGORY_SLOT_RES:
+        m = pattern.search(text)
+        if m:
+            return _strip(text, m), CATEGORY_TERMS[m.group(1)]
+    return text, None
+
+
+def _extract_merchant(text: str) -> Tuple[str, Optional[str]]:
+    m = MERCHANT_SLOT_RE.search(text)
+    if not m:
+        return text, None
+    merchant = m.group(1).strip(" .-")
+    words = merchant.split()
+    if not words or len(words) > MAX_MERCHANT_WORDS or (MERCHANT_STOP_WORDS | MERCHANT_QUALIFIERS) & set(words):
+        raise ValueError("merchant slot too broad")
+    # a date the date extractor declined ("from may", "from 2024 q1") isn't a merchant
+    if any(w.replace(".", "").isdigit() or w in MONTHS for w in words):
+        raise ValueError("merchant slot looks like a date")
+    return _strip(text, m), merchant
+
+
+def _where(user_id: str, slots: Dict, alias: str = "") -> str:
+    col = f"{alias}." if alias else ""
+    clauses = [f"{col}user_id = {_quote(user_id)}"]
+    if slots.get("date"):
+        lower, upper = slots["date"]
+        clauses.append(f"{col}transaction_date >= {lower}")
+        if upper:
+            clauses.append(f"{col}transaction_date < {upper}")
+    if slots.get("category"):
+        clauses.append(f"{col}expense_category = {_quote(slots['category'])}")
+    if slots.get("merchant"):
+        clauses.append(f"{col}merchant_name ILIKE {_like_pattern(slots['merchant'])}")
+    return " AND ".join(clauses)
+
+
+def _top_n(slots: Dict) -> int:
+    return min(int(slots.get("n") or DEFAULT_TOP_N), MAX_TOP_N)
+
+
+RENDERERS: Dict[str, Callable[[str, Dict], str]] = {
+    "total": lambda uid, s: (
+        "SELECT COALESCE(SUM(total_amount), 0) AS total_spent, COUNT(*) AS receipt_count "
+        f"FROM receipts WHERE {_where(uid, s)}"
+    ),
+    "count": lambda uid, s: (
+        f"SELECT COUNT(*) AS receipt_count FROM receipts WHERE {_where(uid, s)}"
+    ),
+    "by_category": lambda uid, s: (
+        "SELECT expense_category, SUM(total_amount) AS total_spent, COUNT(*) AS receipt_count "
+        f"FROM receipts WHERE {_where(uid, s)} "
+        "GROUP BY expense_category ORDER BY total_spent DESC"
+    ),
+    "by_month": lambda uid, s: (
+        "SELECT date_trunc('month', transaction_date)::date AS month, "
+        "SUM(total_amount) AS total_spent, COUNT(*) AS receipt_count "
+        f"FROM receipts WHERE {_where(uid, s)} GROUP BY 1 ORDER BY 1"
+    ),
+    "top_merchants": lambda uid, s: (
+        "SELECT merchant_name, SUM(total_amount) AS total_spent, COUNT(*) AS receipt_count "
+        f"FROM receipts WHERE {_where(uid, s)} "
+        f"GROUP BY merchant_name ORDER BY total_spent DESC LIMIT {_top_n(s)}"
+    ),
+    "top_items": lambda uid, s: (
+        "SELECT ri.description, SUM(ri.quantity) AS total_quantity, SUM(ri.line_total) AS total_spent "
+        "FROM receipt_items ri JOIN receipts r ON ri.receipt_id = r.id "
+        f"WHERE {_where(uid, s, 'r')} "
+        f"GROUP BY ri.description ORDER BY total_spent DESC LIMIT {_top_n(s)}"
+    ),
+    "list": lambda uid, s: (
+        "SELECT id, merchant_name, transaction_date, total_amount, expense_category "
+        f"FROM receipts WHERE {_where(uid, s)} "
+        f"ORDER BY transaction_date DESC LIMIT {LIST_LIMIT}"
+    ),
+}
+
+
+def parse(question: str) -> Optional[Tuple[str, Dict]]:
+    """(intent, slots) when the question is one of the known shapes, else None"""
+    if "\n" in question.strip():  # context-enhanced follow-ups go to SQLCoder
+        return None
+    text = _normalize(question)
+    if not text or UNSUPPORTED_WORDS.search(text):
+        return None
+    try:
+        text, date = _extract_date(text)
+        text, category = _extract_category(text)
+        text, merchant = _extract_merchant(text)
+    except ValueError:
+        return None
+
+    slots = {"date": date, "category": category, "merchant": merchant}
+    for intent, pattern in SHAPES.items():
+        m = pattern.fullmatch(text)
+        if not m:
+            continue
+        used = {k for k, v in slots.items() if v}
+        if not used <= SHAPE_SLOTS[intent]:
+            return None
+        slots["n"] = m.groupdict().get("n")
+        return intent, slots
+    return None
+
+
+def compile_question(question: str, user_id: str) -> Optional[str]:
+    """
+    SQL for the question when it matches a known shape, else None (use SQLCoder).
+    Values are validated or quoted: user_id must be a UUID and categories come
+    from a fixed list, so only the merchant name is free text.
+    """
+    if not INTENT_COMPILER_ENABLED:
+        return None
+    started = time.perf_counter()
+    try:
+        uuid.UUID(str(user_id))
+    except ValueError:
+        return None
+
+    parsed = parse(question)
+    stats.incr("questions")
+    stats.observe("latency_ms", (time.perf_counter() - started) * 1000)
+    if parsed is None:
+        stats.incr("fallbacks")
+        stats.set("coverage", stats.ratio("compiled", "questions"))
+        return None
+
+    intent, slots = parsed
+    sql = RENDERERS[intent](str(user_id), slots)
+    stats.incr("compiled")
+    stats.incr(f"intent:{intent}")
+    stats.set("coverage", stats.ratio("compiled", "questions"))
+    return sql
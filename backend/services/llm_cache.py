@@ -0,0 +1,174 @@
+"""
+LLM Response Cache
+Caches model responses keyed by (model, sampling params, rendered prompt)
+with per-call-site TTLs, an LRU memory cap and an optional SQLite backend
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from services.metrics import get_stats
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_MB", "32")) * 1024 * 1024
+LLM_CACHE_SQLITE_PATH = os.getenv("LLM_CACHE_SQLITE_PATH", "")  # empty: memory only
+# Calls at or below this temperature are treated as deterministic
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.1"))
+# Sites whose sampling isn't pinned but whose answers are still worth reusing
+LLM_CACHE_OPT_IN_SITES = set(
+    s.strip() for s in os.getenv("LLM_CACHE_OPT_IN_SITES", "sql,explain").split(",") if s.strip()
+)
+
+# TTL in seconds per call site; 0 disables caching for the site.
+# Override with LLM_CACHE_TTLS='{"classify": 300}'
+CALL_SITE_TTLS: Dict[str, int] = {
+    "validate": 24 * 3600,
+    "classify": 600,
+    "sql": 3600,
+    "explain": 300,
+    **json.loads(os.getenv("LLM_CACHE_TTLS", "{}")),
+}
+
+stats = get_stats("llm_cache")
+
+
+def make_key(model: str, params: Dict[str, Any], prompt: str) -> str:
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    blob = json.dumps({"model": model, "params": params, "prompt": prompt_hash}, sort_keys=True)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class SQLiteBackend:
+    """Persistent tier so warm entries survive restarts and are shared by workers"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, key: str, value: str, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+            # opportunistically purge expired rows
+            self._conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+
+
+class LLMResponseCache:
+    def __init__(self, max_bytes: int, backend: Optional[SQLiteBackend] = None):
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._bytes = 0
+
+    def cacheable(self, site: str, params: Dict[str, Any]) -> bool:
+        if CALL_SITE_TTLS.get(site, 0) <= 0:
+            return False
+        temperature = params.get("temperature")
+        if temperature is not None and temperature <= LLM_CACHE_MAX_TEMPERATURE:
+            return True
+        return site in LLM_CACHE_OPT_IN_SITES
+
+    def get(self, site: str, model: str, params: Dict[str, Any], prompt: str) -> Optional[str]:
+        if not self.cacheable(site, params):
+            return None
+        key = make_key(model, params, prompt)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self._hit(site)
+                    return entry[0]
+                self._remove(key)
+        if self.backend is not None:
+            stored = self.backend.get(key)
+            if stored is not None and stored[1] > now:
+                self._put(key, stored[0], stored[1])
+                self._hit(site)
+                return stored[0]
+        stats.incr(f"misses:{site}")
+        self._update_rate(site)
+        return None
+
+    def set(self, site: str, model: str, params: Dict[str, Any], prompt: str, value: str):
+        if not value or not self.cacheable(site, params):
+            return
+        key = make_key(model, params, prompt)
+        expires_at = time.time() + CALL_SITE_TTLS[site]
+        self._put(key, value, expires_at)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, value, expires_at)
+            except sqlite3.Error as e:
+                print(f"[LLM cache] persistent write failed: {e}")
+
+    def _hit(self, site: str):
+        stats.incr(f"hits:{site}")
+        self._update_rate(site)
+
+    def _update_rate(self, site: str):
+        hits, misses = stats.get(f"hits:{site}"), stats.get(f"misses:{site}")
+        stats.set(f"hit_rate:{site}", hits / (hits + misses) if hits + misses else 0.0)
+
+    def _put(self, key: str, value: str, expires_at: float):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at)
+            self._bytes += len(key) + len(value)
+            while self._bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                stats.incr("evictions")
+            stats.set("memory_bytes", self._bytes)
+
+    def _remove(self, key: str):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(key) + len(value)
+
+
+def _build() -> Optional[LLMResponseCache]:
+    if not LLM_CACHE_ENABLED:
+        return None
+    backend = None
+    if LLM_CACHE_SQLITE_PATH:
+        try:
+            backend = SQLiteBackend(LLM_CACHE_SQLITE_PATH)
+        except sqlite3.Error as e:
+            print(f"[LLM cache] persistent backend disabled: {e}")
+    return LLMResponseCache(LLM_CACHE_MAX_BYTES, backend)
+
+
+llm_cache = _build()
+
+
+def cache_get(site: str, model: str, params: Dict[str, Any], prompt: str) -> Optional[str]:
+    """Cached response for the call, or None (also when caching is disabled)"""
+    return llm_cache.get(site, model, params, prompt) if llm_cache else None
+
+
+def cache_set(site: str, model: str, params: Dict[str, Any], prompt: str, value: str):
+    if llm_cache:
+        llm_cache.set(site, model, params, prompt, value)
@@ -0,0 +1,125 @@
+"""
+LLM Gateway
+Single async entry point for Groq chat completions with global and
+per-model concurrency limits and token-bucket rate control matched to
+the Groq quota (requests/min and tokens/min per model)
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Tuple
+
+from services.groq_client import asyncGroqClient
+from services.metrics import get_stats
+
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "8"))
+GROQ_MODEL_CONCURRENCY = int(os.getenv("GROQ_MODEL_CONCURRENCY", "4"))
+
+# (requests/min, tokens/min) per model; override with
+# GROQ_MODEL_QUOTAS='{"llama-3.1-8b-instant": [30, 6000], ...}'
+DEFAULT_MODEL_QUOTAS: Dict[str, Tuple[int, int]] = {
+    "llama-3.1-8b-instant": (30, 6000),
+    "meta-llama/llama-4-scout-17b-16e-instruct": (30, 30000),
+    "meta-llama/llama-4-maverick-17b-128e-instruct": (30, 6000),
+}
+FALLBACK_QUOTA = (30, 6000)
+MODEL_QUOTAS: Dict[str, Tuple[int, int]] = {
+    **DEFAULT_MODEL_QUOTAS,
+    **{k: tuple(v) for k, v in json.loads(os.getenv("GROQ_MODEL_QUOTAS", "{}")).items()},
+}
+
+stats = get_stats("llm_gateway")
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at `per_minute` tokens/min"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float):
+        amount = min(amount, self.capacity)
+        async with self._lock:  # waiters are served in arrival order
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, delta: float):
+        """Give back (positive) or charge (negative) tokens after the fact"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + delta)
+
+
+class _ModelLimits:
+    def __init__(self, model: str):
+        rpm, tpm = MODEL_QUOTAS.get(model, FALLBACK_QUOTA)
+        self.slots = asyncio.Semaphore(GROQ_MODEL_CONCURRENCY)
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+
+_global_slots = asyncio.Semaphore(GROQ_MAX_CONCURRENCY)
+_model_limits: Dict[str, _ModelLimits] = {}
+
+
+def _limits_for(model: str) -> _ModelLimits:
+    limits = _model_limits.get(model)
+    if limits is None:
+        limits = _model_limits[model] = _ModelLimits(model)
+    return limits
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], max_completion_tokens: int) -> int:
+    """Rough prompt size (~4 chars/token) plus the completion allowance"""
+    chars = sum(len(str(m.get("content", ""))) for m in messages)
+    return chars // 4 + max_completion_tokens
+
+
+async def chat_completion(model: str, messages: List[Dict[str, Any]], **params: Any):
+    """
+    Await a Groq chat completion without blocking the event loop.
+    Waits for the model's rate budget first, then a global and a per-model
+    slot, so a model throttled by its quota doesn't hold concurrency other
+    models could use; the time spent waiting is recorded as queue time.
+    """
+    limits = _limits_for(model)
+    estimated = estimate_tokens(messages, params.get("max_completion_tokens", 256))
+    queued_at = time.perf_counter()
+
+    await limits.requests.acquire(1)
+    await limits.tokens.acquire(estimated)
+    async with _global_slots, limits.slots:
+        queue_ms = (time.perf_counter() - queued_at) * 1000
+        stats.observe("queue_ms", queue_ms)
+        stats.observe(f"queue_ms:{model}", queue_ms)
+
+        started = time.perf_counter()
+        try:
+            resp = await asyncGroqClient.chat.completions.create(
+                model=model, messages=messages, **params
+            )
+        except Exception:
+            stats.incr(f"errors:{model}")
+            raise
+        stats.observe(f"latency_ms:{model}", (time.perf_counter() - started) * 1000)
+
+    stats.incr(f"requests:{model}")
+    usage = getattr(resp, "usage", None)
+    if usage is not None and usage.total_tokens:
+        stats.incr(f"tokens:{model}", usage.total_tokens)
+        limits.tokens.adjust(estimated - usage.total_tokens)
+    return resp
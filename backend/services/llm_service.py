@@ -1,12 +1,35 @@
-import json, asyncio
+import json, asyncio, os
+from typing import Optional
 from unicodedata import category
-from .groq_client import groqClient
-from constants.schemas import receipt_schema, category_schema, expense_categories
+from services import llm_gateway
+from services.metrics import get_stats
+from services.category_index import categorize_text
+from constants.schemas import (
+    receipt_schema,
+    category_schema,
+    combined_receipt_schema,
+    expense_categories,
+)
 from prompts.receipt_extract import (
     get_receipt_parser_prompt,
     get_enhanced_category_prompt,
+    get_combined_extraction_prompt,
 )
 
+# "split": two parallel calls (details + category); "combined": one call
+RECEIPT_EXTRACTION_MODE = os.getenv("RECEIPT_EXTRACTION_MODE", "split").lower()
+
+stats = get_stats("llm_extract")
+
+
+def _record_usage(call: str, completion):
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        return
+    stats.incr(f"{call}_calls")
+    stats.incr(f"{call}_prompt_tokens", usage.prompt_tokens or 0)
+    stats.incr(f"{call}_completion_tokens", usage.completion_tokens or 0)
+
 
 def clean_response(text: str) -> str:
     text = text.strip()
@@ -15,10 +38,10 @@ def clean_response(text: str) -> str:
     return text.strip()
 
 
-def call_extract_details_sync(ocr_text: str) -> str:
-    prompt = get_receipt_parser_prompt(ocr_text)
+async def call_extract_details(text: str) -> dict:
+    prompt = get_receipt_parser_prompt(text)
 
-    comp = groqClient.chat.completions.create(
+    comp = await llm_gateway.chat_completion(
         model="meta-llama/llama-4-scout-17b-16e-instruct",
         messages=[{"role": "user", "content": prompt}],
         temperature=0.2,
@@ -27,15 +50,14 @@ def call_extract_details_sync(ocr_text: str) -> str:
         stream=False,
         response_format={"type": "json_schema", "json_schema": receipt_schema},
     )
-    resp = comp.choices[0].message.content
-    return resp
-
+    _record_usage("details", comp)
+    return json.loads(comp.choices[0].message.content)
 
-def call_expense_category_sync(ocr_text: str) -> str:
 
-    prompt = get_enhanced_category_prompt(ocr_text, expense_categories)
+async def call_expense_category(text: str) -> str:
+    prompt = get_enhanced_category_prompt(text, expense_categories)
 
-    completion = groqClient.chat.completions.create(
+    completion = await llm_gateway.chat_completion(
         model="meta-llama/llama-4-scout-17b-16e-instruct",
         messages=[{"role": "user", "content": prompt}],
         temperature=0.1,
@@ -44,17 +66,52 @@ def call_expense_category_sync(ocr_text: str) -> str:
         stream=False,
         response_format={"type": "json_schema", "json_schema": category_schema},
     )
-    return completion.choices[0].message.content
+    _record_usage("category", completion)
+    return json.loads(completion.choices[0].message.content)["expense_category"]
 
 
-# Async wrappers
-async def call_extract_details(text: str) -> dict:
-    loop = asyncio.get_running_loop()
-    raw = await loop.run_in_executor(None, call_extract_details_sync, text)
-    return json.loads(raw)
+async def call_extract_combined(text: str) -> dict:
+    prompt = get_combined_extraction_prompt(text, expense_categories)
+
+    comp = await llm_gateway.chat_completion(
+        model="meta-llama/llama-4-scout-17b-16e-instruct",
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.1,
+        max_completion_tokens=1024,
+        top_p=1,
+        stream=False,
+        response_format={"type": "json_schema", "json_schema": combined_receipt_schema},
+    )
+    _record_usage("combined", comp)
+    return json.loads(comp.choices[0].message.content)
 
 
-async def call_expense_category(text: str) -> str:
-    loop = asyncio.get_running_loop()
-    raw = await loop.run_in_executor(None, call_expense_category_sync, text)
-    return json.loads(raw)["expense_category"]
+async def extract_receipt_fields(
+    text: str, mode: Optional[str] = None, user_id: Optional[str] = None
+) -> dict:
+    """
+    Structured receipt fields plus `expense_category` for the OCR text.
+    `mode` overrides RECEIPT_EXTRACTION_MODE ("split" or "combined").
+    When `user_id` is given and the merchant is already known, the category
+    comes from the merchant index and no category LLM call is made. The
+    lookup is in-memory only (a cold index is a miss and warms in the
+    background), so it adds no I/O ahead of the LLM calls.
+    """
+    known_category = await categorize_text(user_id, text) if user_id else None
+    if known_category:
+        stats.incr("category_from_index")
+        details = await call_extract_details(text)
+        details["expense_category"] = known_category
+        return details
+
+    if (mode or RECEIPT_EXTRACTION_MODE) == "combined":
+        details = await call_extract_combined(text)
+        details.setdefault("expense_category", "Other")
+        return details
+
+    # parallel LLM calls
+    details_task = asyncio.create_task(call_extract_details(text))
+    category_task = asyncio.create_task(call_expense_category(text))
+    details, category = await asyncio.gather(details_task, category_task)
+    details["expense_category"] = category
+    return details
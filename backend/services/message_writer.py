@@ -0,0 +1,166 @@
+"""
+Message Write-Behind Queue
+Optional background persistence for conversation messages: chat turns are
+accepted in memory and flushed to the DB in per-conversation order, in
+batches, with retries. Drains on shutdown.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from services.metrics import get_stats
+
+CONVERSATION_WRITE_BEHIND = os.getenv("CONVERSATION_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+WRITE_BEHIND_WORKERS = int(os.getenv("WRITE_BEHIND_WORKERS", "4"))
+# Beyond this many queued messages callers write synchronously instead
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "5000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "50"))
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "5"))
+WRITE_BEHIND_DRAIN_TIMEOUT = float(os.getenv("WRITE_BEHIND_DRAIN_TIMEOUT", "10"))
+
+stats = get_stats("write_behind")
+
+FlushFn = Callable[[str, List[Dict[str, Any]]], Awaitable[Any]]
+DropFn = Callable[[str, List[Dict[str, Any]]], None]
+
+
+class MessageWriteBehind:
+    """
+    Pending rows are kept per conversation; a conversation is flushed by at
+    most one worker at a time, oldest rows first, so DB order matches
+    acceptance order. Failed batches stay at the head and are retried with
+    backoff; after `max_retries` they are dropped, logged, counted and
+    handed to `on_drop`.
+    """
+
+    def __init__(
+        self,
+        flush: FlushFn,
+        workers: int,
+        max_pending: int,
+        batch_size: int,
+        max_retries: int,
+        on_drop: Optional[DropFn] = None,
+    ):
+        self.flush = flush
+        self.on_drop = on_drop
+        self.workers = workers
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self._pending: "OrderedDict[str, Deque[Dict[str, Any]]]" = OrderedDict()
+        self._depth = 0
+        self._ready: Optional[asyncio.Queue] = None
+        self._scheduled: Set[str] = set()  # queued or being flushed
+        self._tasks: List[asyncio.Task] = []
+        self._idle: Optional[asyncio.Event] = None
+        self._flushed: Dict[str, asyncio.Event] = {}  # waiters in wait_flushed
+
+    async def start(self):
+        """Start the flush workers (called on app startup)"""
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def enqueue(self, conversation_id: str, rows: List[Dict[str, Any]]) -> bool:
+        """
+        Accept rows for background persistence. Returns False when the
+        queue isn't running or is full; the caller should write directly.
+        """
+        if self._ready is None or self._depth + len(rows) > self.max_pending:
+            stats.incr("rejected")
+            return False
+        self._pending.setdefault(conversation_id, deque()).extend(rows)
+        self._depth += len(rows)
+        stats.incr("accepted", len(rows))
+        stats.set("depth", self._depth)
+        self._idle.clear()
+        self._schedule(conversation_id)
+        return True
+
+    def pending(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """Rows accepted for the conversation but not yet confirmed written"""
+        return list(self._pending.get(conversation_id, ()))
+
+    async def wait_flushed(self, conversation_id: str):
+        """
+        Wait until every row queued for the conversation has been written
+        (or dropped). Callers writing inline after a rejected enqueue use
+        this so their rows can't overtake queued ones.
+        """
+        if not self._pending.get(conversation_id):
+            return
+        event = self._flushed.setdefault(conversation_id, asyncio.Event())
+        await event.wait()
+
+    def _schedule(self, conversation_id: str):
+        if conversation_id not in self._scheduled:
+            self._scheduled.add(conversation_id)
+            self._ready.put_nowait(conversation_id)
+
+    async def _worker(self):
+        while True:
+            conversation_id = await self._ready.get()
+            try:
+                await self._flush_conversation(conversation_id)
+            finally:
+                self._scheduled.discard(conversation_id)
+                if self._pending.get(conversation_id):
+                    self._schedule(conversation_id)  # more arrived meanwhile
+                if self._depth == 0:
+                    self._idle.set()
+
+    async def _flush_conversation(self, conversation_id: str):
+        queue = self._pending.get(conversation_id)
+        while queue:
+            batch = [queue[i] for i in range(min(self.batch_size, len(queue)))]
+            for attempt in range(self.max_retries + 1):
+                started = time.perf_counter()
+                try:
+                    await self.flush(conversation_id, batch)
+                    stats.observe("flush_ms", (time.perf_counter() - started) * 1000)
+                    stats.incr("flushed", len(batch))
+                    break
+                except Exception as e:
+                    stats.incr("flush_errors")
+                    if attempt == self.max_retries:
+                        stats.incr("dropped", len(batch))
+                        stats.incr("dropped_batches")
+                        ids = ", ".join(str(row.get("id")) for row in batch)
+                        print(
+                            f"[Write-behind] dropping {len(batch)} messages for {conversation_id} "
+                            f"after {attempt + 1} attempts ({ids}): {e}"
+                        )
+                        if self.on_drop is not None:
+                            self.on_drop(conversation_id, batch)
+                        break
+                    await asyncio.sleep(min(0.2 * 2**attempt, 5.0))
+            for _ in batch:
+                queue.popleft()
+            self._depth -= len(batch)
+            stats.set("depth", self._depth)
+        self._pending.pop(conversation_id, None)
+        event = self._flushed.pop(conversation_id, None)
+        if event is not None:
+            event.set()
+
+    async def drain(self, timeout: float = WRITE_BEHIND_DRAIN_TIMEOUT):
+        """Flush everything accepted so far, then stop the workers (app shutdown)"""
+        if self._ready is None:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"[Write-behind] shutdown with {self._depth} messages unflushed")
+            stats.incr("unflushed_at_shutdown", self._depth)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._ready = None
+        for event in self._flushed.values():
+            event.set()
+        self._flushed.clear()
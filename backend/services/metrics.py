@@ -0,0 +1,84 @@
+"""
+In-process metrics registry
+Lightweight counters and timing observations shared by the services
+"""
+
+import threading
+from typing import Any, Dict
+
+
+class Stats:
+    """A named group of counters and value observations"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._observations: Dict[str, Dict[str, float]] = {}
+
+    def incr(self, key: str, amount: float = 1):
+        """Increment a counter"""
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, key: str, value: float):
+        """Set a gauge-style counter to an absolute value"""
+        with self._lock:
+            self._counters[key] = value
+
+    def get(self, key: str) -> float:
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def observe(self, key: str, value: float):
+        """Record a value (e.g. a latency in ms) as count/sum/min/max"""
+        with self._lock:
+            obs = self._observations.get(key)
+            if obs is None:
+                self._observations[key] = {
+                    "count": 1,
+                    "sum": value,
+                    "min": value,
+                    "max": value,
+                }
+                return
+            obs["count"] += 1
+            obs["sum"] += value
+            obs["min"] = min(obs["min"], value)
+            obs["max"] = max(obs["max"], value)
+
+    def ratio(self, numerator: str, denominator: str) -> float:
+        """Safe ratio of two counters (0.0 when the denominator is empty)"""
+        with self._lock:
+            total = self._counters.get(denominator, 0)
+            return self._counters.get(numerator, 0) / total if total else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            snap: Dict[str, Any] = dict(self._counters)
+            for key, obs in self._observations.items():
+                snap[key] = {
+                    **obs,
+                    "avg": obs["sum"] / obs["count"] if obs["count"] else 0.0,
+                }
+            return snap
+
+
+_registry: Dict[str, Stats] = {}
+_registry_lock = threading.Lock()
+
+
+def get_stats(name: str) -> Stats:
+    """Return the stats group for `name`, creating it on first use"""
+    with _registry_lock:
+        stats = _registry.get(name)
+        if stats is None:
+            stats = _registry[name] = Stats(name)
+        return stats
+
+
+def snapshot_all() -> Dict[str, Dict[str, Any]]:
+    """Snapshot of every registered stats group"""
+    with _registry_lock:
+        groups = list(_registry.values())
+    return {stats.name: stats.snapshot() for stats in groups}
@@ -0,0 +1,208 @@
+"""
+OCR Result Cache
+Content-addressed cache for OCR output, keyed by image hash, OCR engine
+and the pre-processing config that produced it
+"""
+
+import hashlib
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Optional
+
+from services.metrics import get_stats
+from services.offload import run_blocking
+
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+OCR_CACHE_MEMORY_ENTRIES = int(os.getenv("OCR_CACHE_MEMORY_ENTRIES", "256"))
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", ".ocr_cache")
+OCR_CACHE_DISK_MAX_MB = int(os.getenv("OCR_CACHE_DISK_MAX_MB", "200"))
+
+stats = get_stats("ocr_cache")
+
+
+def image_digest(image_bytes: bytes) -> str:
+    """Content hash of an upload; compute once per request and reuse"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def config_version(*settings: object) -> str:
+    """Short hash of the settings that shape OCR output, for cache keys"""
+    return hashlib.sha256(repr(settings).encode()).hexdigest()[:8]
+
+
+def cache_key(digest: str, engine: str, config: str) -> str:
+    """Stable key for an image/engine/config triple"""
+    return f"{engine}-{config}-{digest}"
+
+
+class OCRCacheBackend(ABC):
+    """Interface for a single cache tier"""
+
+    name = "base"
+    blocking = False  # does file/network I/O: call off the event loop
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        """Cached OCR text for `key`, or None"""
+
+    @abstractmethod
+    def set(self, key: str, text: str):
+        """Store OCR text under `key`"""
+
+
+class MemoryLRUCache(OCRCacheBackend):
+    """Bounded in-memory LRU tier"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+            return text
+
+    def set(self, key: str, text: str):
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DiskCache(OCRCacheBackend):
+    """On-disk tier with size-based eviction (least recently used files first)"""
+
+    name = "disk"
+    blocking = True
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._scan())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.txt")
+
+    def _scan(self) -> List[tuple]:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".txt"):
+                st = entry.stat()
+                entries.append((entry.path, st.st_size, st.st_mtime))
+        return entries
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            os.utime(path)  # bump mtime so eviction approximates LRU
+            return text
+        except (FileNotFoundError, OSError):
+            return None
+
+    def set(self, key: str, text: str):
+        data = text.encode("utf-8")
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with self._lock:
+            try:
+                previous = os.path.getsize(path) if os.path.exists(path) else 0
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"[OCR cache] disk write failed: {e}")
+                return
+            self._total_bytes += len(data) - previous
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop oldest files until we're back under 90% of the budget
+        target = int(self.max_bytes * 0.9)
+        for path, size, _ in sorted(self._scan(), key=lambda e: e[2]):
+            if self._total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+                self._total_bytes -= size
+                stats.incr("disk_evictions")
+            except OSError:
+                pass
+
+
+class TieredOCRCache:
+    """Looks up tiers in order and promotes hits into the faster tiers"""
+
+    def __init__(self, tiers: List[OCRCacheBackend]):
+        self.tiers = tiers
+
+    def _hit(self, key: str, i: int, text: str):
+        stats.incr(f"hits_{self.tiers[i].name}")
+        stats.incr("hits")
+        for faster in self.tiers[:i]:
+            faster.set(key, text)  # faster tiers are in-memory
+
+    def get(self, key: str) -> Optional[str]:
+        for i, tier in enumerate(self.tiers):
+            text = tier.get(key)
+            if text is not None:
+                self._hit(key, i, text)
+                return text
+        stats.incr("misses")
+        return None
+
+    def set(self, key: str, text: str):
+        if not text:
+            return  # never cache failed/empty OCR
+        for tier in self.tiers:
+            tier.set(key, text)
+
+    async def get_async(self, key: str) -> Optional[str]:
+        """`get` for the event loop: blocking tiers run on the offload pool"""
+        for i, tier in enumerate(self.tiers):
+            if tier.blocking:
+                text = await run_blocking("disk", tier.get, key)
+            else:
+                text = tier.get(key)
+            if text is not None:
+                self._hit(key, i, text)
+                return text
+        stats.incr("misses")
+        return None
+
+    async def set_async(self, key: str, text: str):
+        if not text:
+            return
+        for tier in self.tiers:
+            if tier.blocking:
+                await run_blocking("disk", tier.set, key, text)
+            else:
+                tier.set(key, text)
+
+
+def build_ocr_cache() -> Optional[TieredOCRCache]:
+    """Build the cache from environment configuration"""
+    if not OCR_CACHE_ENABLED:
+        return None
+    tiers: List[OCRCacheBackend] = [MemoryLRUCache(OCR_CACHE_MEMORY_ENTRIES)]
+    if OCR_CACHE_DIR and OCR_CACHE_DISK_MAX_MB > 0:
+        try:
+            tiers.append(DiskCache(OCR_CACHE_DIR, OCR_CACHE_DISK_MAX_MB * 1024 * 1024))
+        except OSError as e:
+            print(f"[OCR cache] disk tier disabled: {e}")
+    return TieredOCRCache(tiers)
+
+
+ocr_cache = build_ocr_cache()
@@ -1,9 +1,16 @@
 import os
 import io
+import re
+import time
 import base64
-from PIL import Image
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+from PIL import Image, ImageOps
 import pytesseract
 from mistralai import Mistral
+from services.metrics import get_stats
+from services.ocr_cache import cache_key, config_version, image_digest, ocr_cache
+from services.ocr_worker import ocr_pool, OCRQueueFull, OCRJobTimeout
 
 # Initialize Mistral client lazily
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
@@ -12,49 +19,466 @@ if MISTRAL_API_KEY:
 else:
     mistral_client = None
 
+# Pre-processing configuration
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "true").lower() in ("1", "true", "yes")
+OCR_TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", "300"))
+OCR_MAX_DIMENSION = int(os.getenv("OCR_MAX_DIMENSION", "2200"))  # long side, px
+OCR_BINARIZE = os.getenv("OCR_BINARIZE", "false").lower() in ("1", "true", "yes")
+OCR_BINARIZE_THRESHOLD = int(os.getenv("OCR_BINARIZE_THRESHOLD", "160"))
+OCR_MISTRAL_MAX_DIMENSION = int(os.getenv("OCR_MISTRAL_MAX_DIMENSION", "2000"))
+OCR_MISTRAL_JPEG_QUALITY = int(os.getenv("OCR_MISTRAL_JPEG_QUALITY", "80"))
+
+# Orchestration configuration (see do_ocr_async)
+OCR_MODE = os.getenv("OCR_MODE", "fallback").lower()
+OCR_HEDGE_DELAY = float(os.getenv("OCR_HEDGE_DELAY", "1.5"))  # seconds
+OCR_LATENCY_BUDGET = float(os.getenv("OCR_LATENCY_BUDGET", "10"))  # seconds
+OCR_TIER_MIN_CONFIDENCE = float(os.getenv("OCR_TIER_MIN_CONFIDENCE", "80"))  # 0-100
+
+# Provider-wide cap on in-flight Mistral requests from this worker
+# (Tesseract is bounded by the OCR pool's queue)
+MISTRAL_MAX_CONCURRENCY = int(os.getenv("MISTRAL_MAX_CONCURRENCY", "4"))
+_mistral_slots = asyncio.Semaphore(MISTRAL_MAX_CONCURRENCY)
+
+# Key fields a usable receipt transcription must contain (tiered mode)
+TOTAL_PATTERN = re.compile(
+    r"\b(total|amount due|balance due|grand total)\b\D{0,20}\d+[.,]\d{2}", re.IGNORECASE
+)
+DATE_PATTERN = re.compile(
+    r"\b(\d{1,4}[/\-.]\d{1,2}[/\-.]\d{1,4}"
+    r"|\d{1,2} ?(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]* ?\d{2,4}"
+    r"|(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]* \d{1,2},? \d{2,4})\b",
+    re.IGNORECASE,
+)
+
+# EXIF orientations that rotate by 90/270 degrees (width and height swap)
+EXIF_ORIENTATION = 0x0112
+SWAPPED_ORIENTATIONS = {5, 6, 7, 8}
+
+stats = get_stats("ocr")
+
+# Part of every OCR cache key: changing how images are prepared (or bumping
+# OCR_CACHE_VERSION) stops older results from being served
+OCR_CACHE_CONFIG = config_version(
+    os.getenv("OCR_CACHE_VERSION", "1"),
+    OCR_PREPROCESS,
+    OCR_TARGET_DPI,
+    OCR_MAX_DIMENSION,
+    OCR_BINARIZE,
+    OCR_BINARIZE_THRESHOLD,
+    OCR_MISTRAL_MAX_DIMENSION,
+    OCR_MISTRAL_JPEG_QUALITY,
+)
+
+
+def _ms_since(start: float) -> float:
+    return (time.perf_counter() - start) * 1000
+
+
+def _cache_key(digest: str, engine: str) -> str:
+    return cache_key(digest, engine, OCR_CACHE_CONFIG)
+
+
+# ── Pre-processing stage ─────────────────────────────────────────────────────
+def _target_size(size: Tuple[int, int], dpi: Any, max_dimension: int) -> Tuple[int, int]:
+    """Size capped at OCR_TARGET_DPI (when the file carries DPI) and `max_dimension`"""
+    width, height = size
+    scale = 1.0
+    if dpi and dpi[0] and dpi[0] > OCR_TARGET_DPI:
+        scale = OCR_TARGET_DPI / float(dpi[0])
+    scale = min(scale, max_dimension / float(max(width, height)))
+    if scale >= 1.0:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _decode(image_bytes: bytes, mode: str, max_dimension: int) -> Image.Image:
+    """
+    Decode at reduced size: for JPEGs `draft` lets libjpeg decode directly at
+    1/2, 1/4 or 1/8 scale, so we never materialise the full-resolution bitmap.
+    The target is computed in display orientation (after EXIF rotation), as
+    phone photos are usually stored sideways.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    rotated = image.getexif().get(EXIF_ORIENTATION, 1) in SWAPPED_ORIENTATIONS
+    stored = image.size
+    oriented = (stored[1], stored[0]) if rotated else stored
+    target = _target_size(oriented, image.info.get("dpi"), max_dimension)
+    if image.format == "JPEG" and target != oriented:
+        image.draft(mode, (target[1], target[0]) if rotated else target)
+    image = ImageOps.exif_transpose(image)
+    image = image.convert(mode)
+    if max(image.size) > max(target):
+        image.thumbnail(target, Image.LANCZOS)
+    return image
+
+
+def preprocess_for_tesseract(image_bytes: bytes) -> Image.Image:
+    """Grayscale (optionally binarized) image at an OCR-appropriate resolution"""
+    image = _decode(image_bytes, "L", OCR_MAX_DIMENSION)
+    if OCR_BINARIZE:
+        image = ImageOps.autocontrast(image)
+        image = image.point(lambda p: 255 if p > OCR_BINARIZE_THRESHOLD else 0)
+    return image
+
+
+def prepare_mistral_payload(image_bytes: bytes) -> bytes:
+    """Re-encode a compact JPEG for the Mistral request; keep the original if not smaller"""
+    image = _decode(image_bytes, "RGB", OCR_MISTRAL_MAX_DIMENSION)
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=OCR_MISTRAL_JPEG_QUALITY, optimize=True)
+    payload = buf.getvalue()
+    return payload if len(payload) < len(image_bytes) else image_bytes
+
+
+# ── Engines ──────────────────────────────────────────────────────────────────
+def mistral_ocr(image_bytes: bytes) -> str:
+    """Run Mistral Document AI OCR on the image. Raises on API errors."""
+    payload = image_bytes
+    if OCR_PREPROCESS:
+        start = time.perf_counter()
+        try:
+            payload = prepare_mistral_payload(image_bytes)
+        except Exception as e:
+            print(f"[Mistral OCR] pre-processing failed, sending original: {e}")
+        stats.observe("mistral_encode_ms", _ms_since(start))
+        stats.incr("mistral_bytes_in", len(image_bytes))
+        stats.incr("mistral_bytes_saved", len(image_bytes) - len(payload))
+
+    start = time.perf_counter()
+    # Encode bytes to base64
+    b64 = base64.b64encode(payload).decode('utf-8')
+    resp = mistral_client.ocr.process(
+        model="mistral-ocr-latest",
+        document={
+            "type": "image_url", 
+            "image_url": f"data:image/jpeg;base64,{b64}"
+        },
+        include_image_base64=False
+    )
+    stats.observe("mistral_ocr_ms", _ms_since(start))
+    # Collect markdown from pages
+    text_fragments = []
+    for page in getattr(resp, 'pages', []):
+        md = getattr(page, 'markdown', None)
+        if md:
+            text_fragments.append(md)
+    extracted = "\n\n".join(text_fragments)
+    print("[Mistral OCR] extracted text:\n", extracted)
+    return extracted
+
+
+def tesseract_ocr_job(image_bytes: bytes) -> Dict[str, Any]:
+    """
+    Tesseract OCR with per-stage timings. Runs inside the OCR worker process,
+    so timings are returned to the caller rather than recorded here.
+    """
+    try:
+        start = time.perf_counter()
+        if OCR_PREPROCESS:
+            image = preprocess_for_tesseract(image_bytes)
+        else:
+            image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        decode_ms = _ms_since(start)
+
+        start = time.perf_counter()
+        text = pytesseract.image_to_string(image)
+        ocr_ms = _ms_since(start)
+    except Exception as e:
+        # Some pytesseract/PIL exceptions don't survive pickling back to the
+        # parent process (which breaks the pool), so hand back a plain error
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+    print("[Tesseract OCR] extracted text:\n", text)
+    return {"text": text, "decode_ms": decode_ms, "ocr_ms": ocr_ms}
+
+
+def tesseract_ocr_data_job(image_bytes: bytes) -> Dict[str, Any]:
+    """
+    Like `tesseract_ocr_job` but uses `image_to_data` so the result also carries
+    the mean word confidence (0-100) used by the tiered mode.
+    """
+    try:
+        start = time.perf_counter()
+        if OCR_PREPROCESS:
+            image = preprocess_for_tesseract(image_bytes)
+        else:
+            image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        decode_ms = _ms_since(start)
+
+        start = time.perf_counter()
+        data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+        ocr_ms = _ms_since(start)
+    except Exception as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+    # Rebuild lines from the word boxes and average the word confidences
+    lines: Dict[Tuple[int, int, int], List[str]] = {}
+    confidences: List[float] = []
+    for i, word in enumerate(data["text"]):
+        word = (word or "").strip()
+        conf = float(data["conf"][i])
+        if not word or conf < 0:
+            continue
+        confidences.append(conf)
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+    text = "\n".join(" ".join(words) for _, words in sorted(lines.items()))
+    confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    print(f"[Tesseract OCR] confidence {confidence:.1f}, extracted text:\n", text)
+    return {"text": text, "confidence": confidence, "decode_ms": decode_ms, "ocr_ms": ocr_ms}
+
+
+def has_key_fields(text: str) -> bool:
+    """True when the text contains a total amount and a transaction date"""
+    return bool(TOTAL_PATTERN.search(text)) and bool(DATE_PATTERN.search(text))
+
+
+def _record_tesseract_job(result: Dict[str, Any]):
+    stats.observe("tesseract_decode_ms", result["decode_ms"])
+    stats.observe("tesseract_ocr_ms", result["ocr_ms"])
+
+
+def tesseract_ocr(image_bytes: bytes) -> str:
+    """Run local Tesseract OCR on the image. Raises on decode/OCR errors."""
+    result = tesseract_ocr_job(image_bytes)
+    _record_tesseract_job(result)
+    return result["text"]
+
 
 def do_ocr(image_bytes: bytes) -> str:
     """
     Uses Mistral Document AI OCR (if configured) or falls back to Tesseract.
+    Results are cached by image content hash and engine, so repeat uploads
+    of the same receipt skip the OCR round trip.
 
     :param image_bytes: Raw image bytes
     :return: Extracted text (as markdown/plain)
     """
+    digest = image_digest(image_bytes) if ocr_cache else ""
     # 1) Try Mistral OCR
     if mistral_client:
+        cached = ocr_cache.get(_cache_key(digest, "mistral")) if ocr_cache else None
+        if cached is not None:
+            return cached
         try:
-            # Encode bytes to base64
-            b64 = base64.b64encode(image_bytes).decode('utf-8')
-            resp = mistral_client.ocr.process(
-                model="mistral-ocr-latest",
-                document={
-                    "type": "image_url", 
-                    "image_url": f"data:image/jpeg;base64,{b64}"
-                },
-                include_image_base64=False
-            )
-            # Collect markdown from pages
-            text_fragments = []
-            for page in getattr(resp, 'pages', []):
-                md = getattr(page, 'markdown', None)
-                if md:
-                    text_fragments.append(md)
-            extracted = "\n\n".join(text_fragments)
-            print("[Mistral OCR] extracted text:\n", extracted)
+            extracted = mistral_ocr(image_bytes)
+            if ocr_cache:
+                ocr_cache.set(_cache_key(digest, "mistral"), extracted)
             return extracted
         except Exception as e:
             print(f"[Mistral OCR] error: {e}, falling back to Tesseract.")
     # 2) Fallback to pytesseract
+    cached = ocr_cache.get(_cache_key(digest, "tesseract")) if ocr_cache else None
+    if cached is not None:
+        return cached
     try:
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        text = pytesseract.image_to_string(image)
-        print("[Tesseract OCR] extracted text:\n", text)
+        text = tesseract_ocr(image_bytes)
+        if ocr_cache:
+            ocr_cache.set(_cache_key(digest, "tesseract"), text)
         return text
     except Exception as e:
         print(f"[Tesseract OCR] error: {e}")
         return ""
 
 
+# ── Async orchestration ──────────────────────────────────────────────────────
+async def _run_engine(
+    engine: str, image_bytes: bytes, digest: str, timeout: Optional[float] = None
+) -> str:
+    """Run one engine off the event loop, recording latency and caching the result"""
+    start = time.perf_counter()
+    if engine == "mistral":
+        loop = asyncio.get_running_loop()
+        async with _mistral_slots:
+            text = await loop.run_in_executor(None, mistral_ocr, image_bytes)
+    else:
+        result = await ocr_pool.submit(tesseract_ocr_job, image_bytes, timeout=timeout)
+        _record_tesseract_job(result)
+        text = result["text"]
+    stats.observe(f"{engine}_latency_ms", _ms_since(start))
+    if ocr_cache:
+        await ocr_cache.set_async(_cache_key(digest, engine), text)
+    return text
+
+
+async def _cached(digest: str, *engines: str) -> Optional[str]:
+    if not ocr_cache:
+        return None
+    for engine in engines:
+        cached = await ocr_cache.get_async(_cache_key(digest, engine))
+        if cached is not None:
+            return cached
+    return None
+
+
+async def _fallback_ocr(image_bytes: bytes, digest: str) -> str:
+    """Mistral first, Tesseract only after Mistral fails"""
+    # 1) Try Mistral OCR
+    if mistral_client:
+        cached = await _cached(digest, "mistral")
+        if cached is not None:
+            return cached
+        try:
+            return await _run_engine("mistral", image_bytes, digest)
+        except Exception as e:
+            print(f"[Mistral OCR] error: {e}, falling back to Tesseract.")
+    # 2) Fallback to pytesseract on the process pool
+    cached = await _cached(digest, "tesseract")
+    if cached is not None:
+        return cached
+    try:
+        return await _run_engine("tesseract", image_bytes, digest)
+    except (OCRQueueFull, OCRJobTimeout):
+        raise
+    except Exception as e:
+        print(f"[Tesseract OCR] error: {e}")
+        return ""
+
+
+async def _hedged_ocr(image_bytes: bytes, digest: str) -> str:
+    """
+    Start Mistral; if it hasn't answered within OCR_HEDGE_DELAY (or fails),
+    start Tesseract in parallel. The first non-empty result wins and the other
+    engine is cancelled. Raises OCRJobTimeout once OCR_LATENCY_BUDGET is spent,
+    and OCRQueueFull when nothing succeeded because the OCR pool turned
+    Tesseract away (as the fallback mode does).
+    """
+    cached = await _cached(digest, "mistral", "tesseract")
+    if cached is not None:
+        return cached
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + OCR_LATENCY_BUDGET
+    hedge_at = loop.time() + OCR_HEDGE_DELAY
+    stats.incr("hedged_requests")
+
+    tasks: Dict[asyncio.Task, str] = {
+        asyncio.create_task(_run_engine("mistral", image_bytes, digest)): "mistral"
+    }
+    hedged = False
+    rejected: Optional[OCRQueueFull] = None
+
+    def start_tesseract():
+        remaining = max(0.1, deadline - loop.time())
+        task = asyncio.create_task(
+            _run_engine("tesseract", image_bytes, digest, timeout=remaining)
+        )
+        tasks[task] = "tesseract"
+        stats.incr("hedges_fired")
+
+    try:
+        while tasks:
+            now = loop.time()
+            if now >= deadline:
+                break
+            wake_at = deadline if hedged else min(hedge_at, deadline)
+            done, _ = await asyncio.wait(
+                tasks, timeout=wake_at - now, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                if not hedged:
+                    hedged = True
+                    start_tesseract()
+                continue
+
+            for task in done:
+                engine = tasks.pop(task)
+                error = task.exception()
+                text = task.result() if error is None else ""
+                if text:
+                    stats.incr(f"wins_{engine}")
+                    for name in ("mistral", "tesseract"):
+                        stats.set(
+                            f"win_rate_{name}",
+                            stats.ratio(f"wins_{name}", "hedged_requests"),
+                        )
+                    return text
+                print(f"[Hedged OCR] {engine} gave no result: {error}")
+                stats.incr(f"failures_{engine}")
+                if isinstance(error, OCRQueueFull):
+                    rejected = error
+                if not hedged:
+                    hedged = True
+                    start_tesseract()
+    finally:
+        for task, engine in tasks.items():
+            task.cancel()
+            stats.incr(f"cancelled_{engine}")
+
+    if loop.time() >= deadline:
+        stats.incr("budget_exceeded")
+        raise OCRJobTimeout(f"OCR exceeded latency budget of {OCR_LATENCY_BUDGET}s")
+    if rejected is not None:
+        stats.incr("rejected_pool_busy")
+        raise rejected
+    return ""
+
+
+async def _tiered_ocr(image_bytes: bytes, digest: str) -> str:
+    """
+    Local Tesseract first; accept it when the mean word confidence reaches
+    OCR_TIER_MIN_CONFIDENCE and a total and date were found, otherwise
+    escalate to Mistral.
+    """
+    cached = await _cached(digest, "mistral", "tesseract")
+    if cached is not None:
+        return cached
+
+    stats.incr("tiered_requests")
+    result = None
+    try:
+        result = await ocr_pool.submit(tesseract_ocr_data_job, image_bytes)
+    except (OCRQueueFull, OCRJobTimeout):
+        if not mistral_client:
+            raise
+        stats.incr("escalations_pool_busy")
+    except Exception as e:
+        print(f"[Tesseract OCR] error: {e}")
+
+    if result is not None:
+        _record_tesseract_job(result)
+        stats.observe("tesseract_confidence", result["confidence"])
+        if result["confidence"] >= OCR_TIER_MIN_CONFIDENCE and has_key_fields(result["text"]):
+            stats.incr("accepted_local")
+            stats.set("escalation_rate", stats.ratio("escalations", "tiered_requests"))
+            if ocr_cache:
+                await ocr_cache.set_async(_cache_key(digest, "tesseract"), result["text"])
+            return result["text"]
+
+    local_text = result["text"] if result is not None else ""
+    if not mistral_client:
+        return local_text
+
+    stats.incr("escalations")
+    stats.set("escalation_rate", stats.ratio("escalations", "tiered_requests"))
+    try:
+        return await _run_engine("mistral", image_bytes, digest)
+    except Exception as e:
+        print(f"[Mistral OCR] error: {e}, keeping low-confidence Tesseract text.")
+        return local_text
+
+
+async def do_ocr_async(image_bytes: bytes) -> str:
+    """
+    Async variant of `do_ocr` for the API: Mistral runs on a thread (I/O bound),
+    Tesseract runs on the OCR process pool (CPU bound).
+
+    OCR_MODE selects the orchestration:
+      - "fallback" (default): Mistral, then Tesseract if Mistral fails
+      - "hedged": race Tesseract against a slow Mistral under a latency budget
+      - "tiered": Tesseract first, escalate to Mistral only on low confidence
+
+    Raises OCRQueueFull / OCRJobTimeout from the pool so callers can apply
+    backpressure instead of queueing unboundedly.
+    """
+    # hashed once per request; every cache lookup and write reuses it
+    digest = image_digest(image_bytes) if ocr_cache else ""
+    if OCR_MODE == "hedged" and mistral_client:
+        return await _hedged_ocr(image_bytes, digest)
+    if OCR_MODE == "tiered":
+        return await _tiered_ocr(image_bytes, digest)
+    return await _fallback_ocr(image_bytes, digest)
+
+
 # # ocr.py using pytesseract
 # from PIL import Image
 # import pytesseract
@@ -0,0 +1,126 @@
+"""
+OCR Worker Pool
+Process pool for CPU-bound OCR jobs (PIL decode + Tesseract) with a bounded
+submission queue and per-job timeouts
+"""
+
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from services.metrics import get_stats
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 2)))
+OCR_QUEUE_SIZE = int(os.getenv("OCR_QUEUE_SIZE", str(OCR_WORKERS * 4)))
+OCR_JOB_TIMEOUT = float(os.getenv("OCR_JOB_TIMEOUT", "30"))
+
+stats = get_stats("ocr_pool")
+
+
+class OCRQueueFull(RuntimeError):
+    """Raised when the pool already has `queue_size` jobs in flight"""
+
+
+class OCRJobTimeout(RuntimeError):
+    """Raised when a job does not finish within its timeout"""
+
+
+def _init_worker():
+    # Runs in every worker process as it starts: import the module the job
+    # functions live in (PIL, pytesseract, mistralai and the rest), so the
+    # first real job doesn't pay for it
+    import services.ocr_service  # noqa: F401
+
+
+def _warmup() -> int:
+    return os.getpid()
+
+
+class OCRWorkerPool:
+    """Process pool sized from the CPU count, shared by all OCR requests"""
+
+    def __init__(self, workers: int, queue_size: int, job_timeout: float):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.job_timeout = job_timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _ensure_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn rather than fork: the API process already runs threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return self._executor
+
+    async def start(self):
+        """
+        Spawn every worker process (called on app startup); each one runs
+        _init_worker before taking its first job
+        """
+        executor = self._ensure_executor()
+        futures = [
+            asyncio.wrap_future(executor.submit(_warmup)) for _ in range(self.workers)
+        ]
+        pids = await asyncio.gather(*futures, return_exceptions=True)
+        print(f"[OCR pool] warmed {len(set(p for p in pids if isinstance(p, int)))} workers")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+            stats.set("pending", self._pending)
+
+    async def submit(
+        self, fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None
+    ) -> Any:
+        """
+        Run `fn(*args)` in a worker process.
+        Raises OCRQueueFull when saturated and OCRJobTimeout on timeout.
+        """
+        with self._lock:
+            if self._pending >= self.queue_size:
+                stats.incr("rejected")
+                raise OCRQueueFull(
+                    f"OCR queue is full ({self._pending}/{self.queue_size} jobs in flight)"
+                )
+            self._pending += 1
+            stats.set("pending", self._pending)
+
+        try:
+            future = self._ensure_executor().submit(fn, *args)
+        except BrokenProcessPool:
+            self._release(None)
+            self._executor = None
+            raise
+        # The slot is only freed once the job really finishes, so a timed-out
+        # job that is still running keeps counting against the queue
+        future.add_done_callback(self._release)
+        stats.incr("submitted")
+
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), timeout or self.job_timeout
+            )
+        except asyncio.TimeoutError:
+            stats.incr("timeouts")
+            raise OCRJobTimeout(f"OCR job exceeded {timeout or self.job_timeout}s")
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM on a huge image); start fresh next time
+            self._executor = None
+            raise
+
+
+ocr_pool = OCRWorkerPool(OCR_WORKERS, OCR_QUEUE_SIZE, OCR_JOB_TIMEOUT)
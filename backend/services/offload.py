@@ -0,0 +1,52 @@
+"""
+Bounded Offload Pools
+Named thread pools for blocking SDK calls (Supabase, Cloudflare via
+requests) and local file I/O (OCR disk cache) so they never run on the
+event loop thread and can't grow without bound
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from services.metrics import get_stats
+
+POOL_SIZES: Dict[str, int] = {
+    "db": int(os.getenv("OFFLOAD_DB_WORKERS", "16")),
+    "http": int(os.getenv("OFFLOAD_HTTP_WORKERS", "16")),
+    "disk": int(os.getenv("OFFLOAD_DISK_WORKERS", "4")),
+}
+
+stats = get_stats("offload")
+
+_pools: Dict[str, ThreadPoolExecutor] = {
+    name: ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"offload-{name}")
+    for name, size in POOL_SIZES.items()
+}
+
+
+async def run_blocking(pool: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run `fn(*args, **kwargs)` on the named pool and await the result"""
+    submitted = time.perf_counter()
+
+    def timed():
+        started = time.perf_counter()
+        stats.observe(f"wait_ms:{pool}", (started - submitted) * 1000)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            stats.observe(f"run_ms:{pool}", (time.perf_counter() - started) * 1000)
+
+    stats.incr(f"in_flight:{pool}")
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_pools[pool], timed)
+    finally:
+        stats.incr(f"in_flight:{pool}", -1)
+
+
+def shutdown():
+    for pool in _pools.values():
+        pool.shutdown(wait=False, cancel_futures=True)
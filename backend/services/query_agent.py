@@ -5,16 +5,84 @@ Handles routing between SQL Agent, Analysis Agent, and Query Classification
 
 import asyncio
 import json
-from typing import Dict, List, Optional, Any, Tuple
+import os
+import re
+import time
+from typing import Awaitable, Dict, List, Optional, Any, Tuple
 from services.conversation_service import ConversationMemory, extract_context_from_query
 from services.query_service import (
     validate_question,
-    get_sql_from_question,
-    execute_sql_in_supabase,
-    explain_query_2,
+    get_sql_from_question_async,
+    speculate_sql_async,
+    store_generated_sql,
+    execute_sql_async,
+    explain_query_async,
 )
 from services.supabase_client import supabase
-from .groq_client import groqClient
+from services import intent_compiler, llm_gateway, rollup_service
+from services.llm_cache import cache_get, cache_set
+from services.metrics import get_stats
+
+CLASSIFIER_MODEL = "llama-3.1-8b-instant"
+
+# Start SQL generation while the query is still being classified (only for
+# questions that look like data retrieval, see _likely_needs_sql)
+QUERY_SPECULATIVE_SQL = os.getenv("QUERY_SPECULATIVE_SQL", "true").lower() in ("1", "true", "yes")
+
+# Budget for one chat query end to end; branches still running when it
+# runs out are cancelled and whatever finished is returned
+QUERY_DEADLINE_SECONDS = float(os.getenv("QUERY_DEADLINE_SECONDS", "60"))
+
+speculation_stats = get_stats("speculative_sql")
+engine_stats = get_stats("query_engine")
+
+# Cheap stand-in for the classifier's route: speculate on data questions,
+# not on advice-style ones that go to the analysis agent
+DATA_QUESTION_RE = re.compile(
+    r"\b(how much|how many|total|spent|spend|spending|receipts?|purchases?|transactions?|"
+    r"merchants?|items?|list|show|top|biggest|largest|category|categories)\b"
+)
+ADVICE_QUESTION_RE = re.compile(
+    r"\b(why|should|recommend\w*|advice|advise|tips?|suggest\w*|how (?:can|could|do) i|"
+    r"save money|cut back|improve|insights?|patterns?)\b"
+)
+
+# (question the SQL was generated for, task producing (guarded SQL, fresh
+# SQLCoder output to cache if the speculation is used))
+SpeculativeSQL = Tuple[str, "asyncio.Task[Tuple[str, Optional[str]]]"]
+
+
+def _likely_needs_sql(question: str) -> bool:
+    """Whether the classifier will probably route to the sql or hybrid agent"""
+    if intent_compiler.parse(question) is not None:
+        return True  # compiles locally, so speculating costs nothing
+    text = question.lower()
+    return bool(DATA_QUESTION_RE.search(text)) and not ADVICE_QUESTION_RE.search(text)
+
+
+def _discard_speculation(speculative_sql: Optional[SpeculativeSQL], reason: str):
+    """
+    Cancel an unused speculative SQL generation and count it as waste.
+    Cancelling only abandons the awaiting task: a SQLCoder request already
+    running on the offload thread still completes (and is still paid for);
+    its output just isn't cached or used.
+    """
+    if speculative_sql is None:
+        return
+    _, task = speculative_sql
+    if task.done():
+        if not task.cancelled():
+            task.exception()  # mark retrieved
+    else:
+        task.cancel()
+    speculation_stats.incr("wasted")
+    speculation_stats.incr(f"wasted:{reason}")
+    _update_speculation_rates()
+
+
+def _update_speculation_rates():
+    speculation_stats.set("hit_rate", speculation_stats.ratio("hits", "started"))
+    speculation_stats.set("waste_rate", speculation_stats.ratio("wasted", "started"))
 
 
 class QueryClassifier:
@@ -27,6 +95,7 @@ class QueryClassifier:
         """
         Classify query complexity and determine routing
         Returns: {
+            "relevant": bool,  # replaces a separate validate_question call
             "agent": "sql" | "analysis" | "hybrid",
             "complexity": 1 | 2 | 3,
             "requires_context": bool,
@@ -48,6 +117,11 @@ Recent conversation context:
 
 Classify based on these criteria:
 
+RELEVANCE:
+- relevant: true if the query is about the user's own receipts, spending or
+  expenses (or a follow-up to such a question); false otherwise
+  (e.g. "What's the weather today?", "Tell me a joke")
+
 COMPLEXITY LEVELS:
 1. Simple data retrieval (basic SQL queries)
 2. Context-aware follow-ups (require conversation history)  
@@ -60,6 +134,7 @@ AGENT TYPES:
 
 Return ONLY a JSON object:
 {{
+    "relevant": true|false,
     "agent": "sql|analysis|hybrid",
     "complexity": 1|2|3,
     "requires_context": true|false,
@@ -69,15 +144,30 @@ Return ONLY a JSON object:
 """
 
         try:
-            resp = groqClient.chat.completions.create(
-                model="llama-3.1-8b-instant",
-                messages=[{"role": "user", "content": classification_prompt}],
-                temperature=0.1,
-                max_completion_tokens=200,
-                response_format={"type": "json_object"},
-            )
-
-            classification = json.loads(resp.choices[0].message.content)
+            params = {
+                "temperature": 0.1,
+                "max_completion_tokens": 200,
+                "response_format": {"type": "json_object"},
+            }
+            content = cache_get("classify", CLASSIFIER_MODEL, params, classification_prompt)
+            if content is None:
+                resp = await llm_gateway.chat_completion(
+                    model=CLASSIFIER_MODEL,
+                    messages=[{"role": "user", "content": classification_prompt}],
+                    **params,
+                )
+                content = resp.choices[0].message.content
+                classification = json.loads(content)
+                cache_set("classify", CLASSIFIER_MODEL, params, classification_prompt, content)
+            else:
+                classification = json.loads(content)
+
+            if "relevant" in classification and not isinstance(
+                classification["relevant"], bool
+            ):
+                classification["relevant"] = (
+                    str(classification["relevant"]).strip().lower() == "true"
+                )
 
             # Override with context info if needed
             if context_info["requires_context"]:
@@ -102,30 +192,49 @@ Return ONLY a JSON object:
 class SQLAgent:
     """Handles direct data retrieval queries"""
 
+    @staticmethod
+    def build_question(
+        query: str, conversation_memory: ConversationMemory, requires_context: bool
+    ) -> str:
+        """The question sent to SQLCoder, with conversation context if needed"""
+        if not (requires_context and conversation_memory.messages):
+            return query
+        context = conversation_memory.get_conversation_context()
+        return f"""
+Based on our conversation:
+{context}
+
+Current question: {query}
+
+Please provide a complete answer considering the conversation context.
+"""
+
     @staticmethod
     async def process_query(
         query: str,
         user_id: str,
         conversation_memory: ConversationMemory,
         classification: Dict[str, Any],
+        speculative_sql: Optional[SpeculativeSQL] = None,
     ) -> Dict[str, Any]:
-        """Process SQL-based queries with optional context"""
+        """
+        Process SQL-based queries with optional context.
+        `speculative_sql` is SQL generation already started by the orchestrator;
+        it is used when it was generated for the same question, else cancelled.
+        """
 
         # Enhance query with context if needed
-        enhanced_query = query
-        if classification.get("requires_context") and conversation_memory.messages:
-            context = conversation_memory.get_conversation_context()
-            enhanced_query = f"""
-Based on our conversation:
-{context}
-
-Current question: {query}
-
-Please provide a complete answer considering the conversation context.
-"""
+        enhanced_query = SQLAgent.build_question(
+            query, conversation_memory, classification.get("requires_context", False)
+        )
 
-        # Validate question
-        if not validate_question(enhanced_query):
+        # Validate question, unless the pre-router already judged relevance
+        if "relevant" in classification:
+            relevant = classification["relevant"]
+        else:
+            relevant = await validate_question(enhanced_query)
+        if not relevant:
+            _discard_speculation(speculative_sql, "irrelevant")
             return {
                 "success": False,
                 "error": "Invalid question. Please ask about your expenses or receipts.",
@@ -134,20 +243,24 @@ Please provide a complete answer considering the conversation context.
 
         try:
             print(f"Processing SQL query: {enhanced_query}")
-            # Generate SQL
-            sql = await asyncio.get_running_loop().run_in_executor(
-                None, get_sql_from_question, enhanced_query, user_id
-            )
+            # Generate SQL (or take the speculative result if it matches)
+            if speculative_sql is not None and speculative_sql[0] == enhanced_query:
+                speculation_stats.incr("hits")
+                _update_speculation_rates()
+                sql, fresh_sql = await speculative_sql[1]
+                if fresh_sql is not None:
+                    store_generated_sql(enhanced_query, user_id, fresh_sql)
+            else:
+                _discard_speculation(speculative_sql, "question_mismatch")
+                sql = await get_sql_from_question_async(enhanced_query, user_id)
             print(f"Generated SQL: {sql}")
 
             # Execute SQL
-            rows = execute_sql_in_supabase(supabase, sql)
+            rows = await execute_sql_async(supabase, sql, user_id)
             print(f"SQL execution result: {rows}")
 
             # Generate explanation
-            answer = await asyncio.get_running_loop().run_in_executor(
-                None, explain_query_2, sql, rows, enhanced_query
-            )
+            answer = await explain_query_async(sql, rows, enhanced_query)
 
             return {
                 "success": True,
@@ -207,7 +320,7 @@ Provide a comprehensive analysis including:
 Be conversational, helpful, and specific. Use actual numbers from the data.
 """
 
-            resp = groqClient.chat.completions.create(
+            resp = await llm_gateway.chat_completion(
                 model="meta-llama/llama-4-maverick-17b-128e-instruct",
                 messages=[{"role": "user", "content": analysis_prompt}],
                 temperature=0.3,
@@ -237,40 +350,20 @@ Be conversational, helpful, and specific. Use actual numbers from the data.
     async def _get_expense_data_context(user_id: str) -> str:
         """Get relevant expense data for analysis"""
         try:
-            # Get recent spending summary
-            summary_sql = f"""
-            SELECT 
-                expense_category,
-                COUNT(*) as transaction_count,
-                SUM(total_amount) as total_spent,
-                AVG(total_amount) as avg_amount,
-                MAX(transaction_date) as latest_date,
-                MIN(transaction_date) as earliest_date
-            FROM receipts 
-            WHERE user_id = '{user_id}' 
-                AND transaction_date >= CURRENT_DATE - INTERVAL '90 days'
-            GROUP BY expense_category
-            ORDER BY total_spent DESC
-            """
-
-            summary_data = execute_sql_in_supabase(supabase, summary_sql)
+            # Pre-aggregated rollups: no scan over the user's receipts.
+            # The two reads are independent; either one alone is still useful
+            summary_data, merchant_data = await asyncio.gather(
+                rollup_service.get_category_summary(user_id, days=90),
+                rollup_service.get_top_merchants(user_id, days=90, limit=10),
+                return_exceptions=True,
+            )
+            if isinstance(summary_data, Exception):
+                print(f"Error getting category summary: {summary_data}")
+                summary_data = []
+            if isinstance(merchant_data, Exception):
+                print(f"Error getting top merchants: {merchant_data}")
+                merchant_data = []
             print(f"Summary data: {summary_data}")
-
-            # Get top merchants
-            merchant_sql = f"""
-            SELECT 
-                merchant_name,
-                COUNT(*) as visit_count,
-                SUM(total_amount) as total_spent
-            FROM receipts 
-            WHERE user_id = '{user_id}' 
-                AND transaction_date >= CURRENT_DATE - INTERVAL '90 days'
-            GROUP BY merchant_name
-            ORDER BY total_spent DESC
-            LIMIT 10
-            """
-
-            merchant_data = execute_sql_in_supabase(supabase, merchant_sql)
             print(f"Merchant data: {merchant_data}")
 
             # Format context
@@ -297,6 +390,41 @@ Be conversational, helpful, and specific. Use actual numbers from the data.
             return "No expense data available for analysis."
 
 
+async def _run_branches(
+    branches: Dict[str, Awaitable[Dict[str, Any]]], deadline: float
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Run independent agent branches concurrently until `deadline` (loop time).
+    Branches still running then are cancelled and reported as failed results.
+    """
+    loop = asyncio.get_running_loop()
+    tasks = {name: asyncio.ensure_future(coro) for name, coro in branches.items()}
+    done, pending = await asyncio.wait(
+        tasks.values(), timeout=max(0.0, deadline - loop.time())
+    )
+    for task in pending:
+        task.cancel()
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for name, task in tasks.items():
+        if task in pending:
+            engine_stats.incr(f"deadline_exceeded:{name}")
+            results[name] = {
+                "success": False,
+                "error": f"{name} agent did not finish within {QUERY_DEADLINE_SECONDS:.0f}s",
+                "agent": name,
+            }
+        elif task.exception() is not None:
+            results[name] = {
+                "success": False,
+                "error": f"{name} agent error: {task.exception()}",
+                "agent": name,
+            }
+        else:
+            results[name] = task.result()
+    return results
+
+
 class ConversationalQueryEngine:
     """Main orchestrator for conversational queries"""
 
@@ -307,6 +435,9 @@ class ConversationalQueryEngine:
         """
         Process a conversational query with full context and routing
         """
+        speculative_sql: Optional[SpeculativeSQL] = None
+        handed_off: Optional[SpeculativeSQL] = None  # owned by SQLAgent once routed
+        deadline = asyncio.get_running_loop().time() + QUERY_DEADLINE_SECONDS
         try:
             # Load conversation memory
             from services.conversation_service import load_conversation_memory
@@ -314,6 +445,26 @@ class ConversationalQueryEngine:
             memory = await load_conversation_memory(conversation_id)
             print("memory fetched has:", memory.get_conversation_context())
 
+            # Most traffic ends up on the SQL agent: for data questions, start
+            # SQLCoder now on the question SQLAgent will most likely build,
+            # and classify meanwhile
+            if QUERY_SPECULATIVE_SQL and _likely_needs_sql(query):
+                predicted_context = extract_context_from_query(
+                    query, memory.get_conversation_context()
+                )["requires_context"]
+                speculative_question = SQLAgent.build_question(
+                    query, memory, predicted_context
+                )
+                speculative_sql = (
+                    speculative_question,
+                    asyncio.create_task(
+                        speculate_sql_async(speculative_question, user_id)
+                    ),
+                )
+                speculation_stats.incr("started")
+            elif QUERY_SPECULATIVE_SQL:
+                speculation_stats.incr("skipped")
+
             # Classify the query
             classification = await QueryClassifier.classify_query(query, memory)
             print(f"Query classification: {classification}")
@@ -321,32 +472,56 @@ class ConversationalQueryEngine:
             # Route to appropriate agent
             result = None
             if classification["agent"] == "sql":
-                result = await SQLAgent.process_query(
-                    query, user_id, memory, classification
-                )
+                branches = {
+                    "sql": SQLAgent.process_query(
+                        query, user_id, memory, classification, speculative_sql
+                    )
+                }
+                handed_off, speculative_sql = speculative_sql, None
+                result = (await _run_branches(branches, deadline))["sql"]
             elif classification["agent"] == "analysis":
-                result = await AnalysisAgent.process_query(
-                    query, user_id, memory, classification
-                )
+                _discard_speculation(speculative_sql, "analysis_route")
+                speculative_sql = None
+                branches = {
+                    "analysis": AnalysisAgent.process_query(
+                        query, user_id, memory, classification
+                    )
+                }
+                result = (await _run_branches(branches, deadline))["analysis"]
             elif classification["agent"] == "hybrid":
-                # Process with both agents and combine results
-                sql_result = await SQLAgent.process_query(
-                    query, user_id, memory, classification
-                )
-                analysis_result = await AnalysisAgent.process_query(
-                    query, user_id, memory, classification
-                )
-
+                # Both agents are independent: run them side by side
+                started = time.perf_counter()
+                branches = {
+                    "sql": SQLAgent.process_query(
+                        query, user_id, memory, classification, speculative_sql
+                    ),
+                    "analysis": AnalysisAgent.process_query(
+                        query, user_id, memory, classification
+                    ),
+                }
+                handed_off, speculative_sql = speculative_sql, None
+                results = await _run_branches(branches, deadline)
+                engine_stats.observe("hybrid_ms", (time.perf_counter() - started) * 1000)
+                sql_result, analysis_result = results["sql"], results["analysis"]
+
+                succeeded = [r for r in (sql_result, analysis_result) if r.get("success")]
+                failed = [r for r in (sql_result, analysis_result) if not r.get("success")]
+                if succeeded and failed:
+                    engine_stats.incr("partial_results")
                 result = {
-                    "success": True,
-                    "answer": f"{sql_result.get('answer', '')}\n\n{analysis_result.get('answer', '')}",
+                    "success": bool(succeeded),
+                    "answer": "\n\n".join(r.get("answer", "") for r in succeeded),
                     "agent": "hybrid",
                     "sql_data": sql_result.get("result", []),
                     "metadata": {
                         "sql_metadata": sql_result.get("metadata", {}),
                         "analysis_metadata": analysis_result.get("metadata", {}),
+                        "partial": bool(succeeded and failed),
+                        "errors": {r["agent"]: r.get("error") for r in failed},
                     },
                 }
+                if not succeeded:
+                    result["error"] = "; ".join(r.get("error", "") for r in failed)
 
             # Add classification info to result
             if result:
@@ -364,3 +539,9 @@ class ConversationalQueryEngine:
                 "error": f"Query processing error: {str(e)}",
                 "agent": "error",
             }
+        finally:
+            # unknown agent or an error before routing
+            _discard_speculation(speculative_sql, "unused")
+            # SQL branch cut off by the deadline before it consumed the speculation
+            if handed_off is not None and not handed_off[1].done():
+                handed_off[1].cancel()
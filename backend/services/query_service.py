@@ -5,37 +5,93 @@ from groq import GroqError
 from prompts.prompts import VALIDATE_PROMPT, EXPLAIN_PROMPT, SQLCODER_PROMPT_TEMPLATE
 import requests
 import time
+from typing import Optional, Tuple
 from .groq_client import groqClient
+from services import intent_compiler, llm_gateway
+from services.llm_cache import cache_get, cache_set
+from services.offload import run_blocking
+from services.result_summarizer import summarize_rows
+from services.sql_guard import guard_sql
+from services.sql_result_cache import sql_result_cache
+from services.sql_template_cache import sql_template_cache
 
 load_dotenv()
 
 # Cloudflare SQLCoder endpoint
 AUTH_TOKEN = os.getenv("CLOUDFLARE_AUTH_TOKEN")
 CLOUDFLARE_ACCOUNT_ID = os.getenv("CLOUDFLARE_ACCOUNT_ID")
-SQLCODER_URL = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/ai/run/@cf/defog/sqlcoder-7b-2"
+SQLCODER_MODEL = "@cf/defog/sqlcoder-7b-2"
+SQLCODER_URL = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/ai/run/{SQLCODER_MODEL}"
+EXPLAIN_MODEL = "@cf/meta/llama-4-scout-17b-16e-instruct"
+VALIDATE_MODEL = "llama-3.1-8b-instant"
 
 
-def validate_question(question: str) -> bool:
+async def validate_question(question: str) -> bool:
     prompt = VALIDATE_PROMPT.format(question=question)
+    params = {"temperature": 0, "max_completion_tokens": 10, "top_p": 1}
     try:
-        resp = groqClient.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-            max_completion_tokens=10,
-            top_p=1,
-            stream=False,
-        )
-        text = resp.choices[0].message.content
+        text = cache_get("validate", VALIDATE_MODEL, params, prompt)
+        if text is None:
+            resp = await llm_gateway.chat_completion(
+                model=VALIDATE_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                stream=False,
+                **params,
+            )
+            text = resp.choices[0].message.content
+            cache_set("validate", VALIDATE_MODEL, params, prompt, text)
         print("validate question response:", text)
         return text.strip().upper().startswith("YES")
     except GroqError:
         return False
 
 
-# using the sql-coder-7b
 def get_sql_from_question(question: str, user_id: str) -> str:
+    """
+    SQL answering the question, parsed and rewritten by the SQL guard
+    (read-only, scoped to user_id, bounded). Raises UnsafeSQLError when the
+    generated SQL can't be made safe.
+    """
+    sql, _ = _generate_sql(question, user_id)
+    return guard_sql(sql, user_id)
+
+
+def speculate_sql(question: str, user_id: str) -> Tuple[str, Optional[str]]:
+    """
+    Like get_sql_from_question, but nothing is written to the SQL caches:
+    returns (guarded SQL, fresh SQLCoder output or None). Pass the fresh
+    output to store_generated_sql once the speculation is actually used.
+    """
+    sql, fresh = _generate_sql(question, user_id, store=False)
+    return guard_sql(sql, user_id), (sql if fresh else None)
+
+
+def store_generated_sql(question: str, user_id: str, sql: str):
+    """Cache SQLCoder output for the question (LLM cache + template cache)"""
     prompt = SQLCODER_PROMPT_TEMPLATE.format(question=question, user_id=user_id)
+    cache_set("sql", SQLCODER_MODEL, {}, prompt, sql)
+    if sql_template_cache is not None:
+        sql_template_cache.set(question, user_id, sql)
+
+
+# using the sql-coder-7b
+def _generate_sql(question: str, user_id: str, store: bool = True) -> Tuple[str, bool]:
+    """(SQL, whether it came fresh from SQLCoder)"""
+    # Common question shapes compile locally; SQLCoder handles the rest
+    sql = intent_compiler.compile_question(question, user_id)
+    if sql is not None:
+        return sql, False
+
+    # Same question from another user: reuse its SQL with this user's id
+    if sql_template_cache is not None:
+        templated = sql_template_cache.get(question, user_id)
+        if templated is not None:
+            return templated, False
+
+    prompt = SQLCODER_PROMPT_TEMPLATE.format(question=question, user_id=user_id)
+    cached = cache_get("sql", SQLCODER_MODEL, {}, prompt)
+    if cached is not None:
+        return cached, False
     headers = {
         "Authorization": f"Bearer {AUTH_TOKEN}",
         "Content-Type": "application/json",
@@ -46,8 +102,10 @@ def get_sql_from_question(question: str, user_id: str) -> str:
             {"role": "user", "content": prompt},
         ]
     }
+    started = time.perf_counter()
     resp = requests.post(SQLCODER_URL, headers=headers, json=payload)
     data = resp.json()
+    intent_compiler.stats.observe("sqlcoder_ms", (time.perf_counter() - started) * 1000)
     # Check for Cloudflare errors
     if not data.get("success", False):
         raise RuntimeError(f"SQLCoder returned errors: {data.get('errors', data)}")
@@ -55,7 +113,9 @@ def get_sql_from_question(question: str, user_id: str) -> str:
     sql = data["result"]["response"]
 
     sql = sql.replace("```", "").strip().rstrip(";")
-    return sql
+    if store:
+        store_generated_sql(question, user_id, sql)
+    return sql, True
 
 
 # 3) Execute SQL via Supabase RPC
@@ -72,7 +132,7 @@ def execute_sql_in_supabase(supabase, sql: str):
 
 
 def explain_query(sql: str, rows: list, question: str) -> str:
-    prompt = EXPLAIN_PROMPT.format(question=question, sql=sql, rows=json.dumps(rows))
+    prompt = EXPLAIN_PROMPT.format(question=question, sql=sql, rows=summarize_rows(rows))
     # 1) Try primary Groq LLM with retries
     for attempt in range(3):
         try:
@@ -103,10 +163,13 @@ def explain_query(sql: str, rows: list, question: str) -> str:
 
 
 def explain_query_2(sql: str, rows: list, question: str) -> str:
-    prompt = EXPLAIN_PROMPT.format(question=question, sql=sql, rows=json.dumps(rows))
+    prompt = EXPLAIN_PROMPT.format(question=question, sql=sql, rows=summarize_rows(rows))
+    cached = cache_get("explain", EXPLAIN_MODEL, {}, prompt)
+    if cached is not None:
+        return cached
 
     response = requests.post(
-        f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/ai/run/@cf/meta/llama-4-scout-17b-16e-instruct",
+        f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/ai/run/{EXPLAIN_MODEL}",
         headers={"Authorization": f"Bearer {AUTH_TOKEN}"},
         json={
             "messages": [
@@ -125,4 +188,34 @@ def explain_query_2(sql: str, rows: list, question: str) -> str:
         else:
             return "No records found for your query."
 
-    return result["result"]["response"]
+    answer = result["result"]["response"]
+    cache_set("explain", EXPLAIN_MODEL, {}, prompt, answer)
+    return answer
+
+
+# Async wrappers: the blocking HTTP/RPC calls run on bounded offload pools
+async def get_sql_from_question_async(question: str, user_id: str) -> str:
+    return await run_blocking("http", get_sql_from_question, question, user_id)
+
+
+async def speculate_sql_async(question: str, user_id: str) -> Tuple[str, Optional[str]]:
+    return await run_blocking("http", speculate_sql, question, user_id)
+
+
+async def execute_sql_async(supabase, sql: str, user_id: Optional[str] = None):
+    """
+    Run the SQL off the event loop. With a user_id, results are served from
+    the per-user result cache until that user's receipts change.
+    """
+    if user_id is None or sql_result_cache is None:
+        return await run_blocking("db", execute_sql_in_supabase, supabase, sql)
+    rows, version = sql_result_cache.get(str(user_id), sql)
+    if rows is not None:
+        return rows
+    rows = await run_blocking("db", execute_sql_in_supabase, supabase, sql)
+    sql_result_cache.set(str(user_id), sql, rows, version)
+    return rows
+
+
+async def explain_query_async(sql: str, rows: list, question: str) -> str:
+    return await run_blocking("http", explain_query_2, sql, rows, question)
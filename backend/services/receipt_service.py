@@ -2,6 +2,9 @@ from services.supabase_client import supabase
 from postgrest.exceptions import APIError
 import datetime, asyncio
 from services.s3_client import upload_image_to_s3
+from services.category_index import category_index
+from services.sql_result_cache import invalidate_user
+from services import rollup_service
 from typing import Dict, Any, List
 
 async def save_receipt(
@@ -50,6 +53,11 @@ async def save_receipt(
 
     saved_receipt = resp.data[0]
     receipt_id = saved_receipt.get("id")
+    await rollup_service.record_receipt(saved_receipt)
+    invalidate_user(user_id)  # after the rollups so cached reads see both
+    category_index.record(
+        user_id, saved_receipt.get("merchant_name"), saved_receipt.get("expense_category")
+    )
 
     # 4️⃣ Insert line-items
     items: List[Dict[str, Any]] = parsed.get("items", []) or []
@@ -67,6 +75,7 @@ async def save_receipt(
             resp_items = supabase.table("receipt_items").insert(item_rows).execute()
         except APIError as e:
             raise RuntimeError(f"Items insert failed: {e.message}")
+        invalidate_user(user_id)
 
     # 5️⃣ Return the saved receipt
     return saved_receipt
@@ -0,0 +1,112 @@
+"""
+Result Summarizer
+Shrinks SQL results before they are embedded in EXPLAIN_PROMPT: small
+results pass through verbatim, large ones become row count, per-column
+aggregates / histograms and the first rows, fitted to a token budget.
+Only the prompt is affected; callers still return the full rows.
+"""
+
+import json
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, List
+
+from services.llm_gateway import estimate_tokens
+from services.metrics import get_stats
+
+EXPLAIN_ROWS_TOKEN_BUDGET = int(os.getenv("EXPLAIN_ROWS_TOKEN_BUDGET", "1500"))
+MAX_TOP_ROWS = 20
+MAX_HISTOGRAM_VALUES = 10
+
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+stats = get_stats("result_summarizer")
+
+
+def _tokens(text: str) -> int:
+    return estimate_tokens([{"content": text}], 0)
+
+
+def _number(value: Any):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def _describe_column(name: str, values: List[Any], histogram_size: int) -> Dict[str, Any]:
+    present = [v for v in values if v is not None]
+    info: Dict[str, Any] = {"nulls": len(values) - len(present)}
+    if not present:
+        return info
+
+    numbers = [_number(v) for v in present]
+    if all(n is not None for n in numbers):
+        if name == "id" or name.endswith("_id"):  # identifiers: sums mean nothing
+            info.update({"min": min(numbers), "max": max(numbers)})
+            return info
+        info.update(
+            {
+                "sum": round(sum(numbers), 2),
+                "min": min(numbers),
+                "max": max(numbers),
+                "avg": round(sum(numbers) / len(numbers), 2),
+            }
+        )
+        return info
+
+    text = [str(v) for v in present]
+    if all(ISO_DATE.match(t) for t in text):
+        info.update({"min": min(text), "max": max(text)})
+    counts = Counter(text)
+    info["distinct"] = len(counts)
+    info["top_values"] = counts.most_common(histogram_size)
+    return info
+
+
+def _summary(rows: List[Dict[str, Any]], top_rows: int, histogram_size: int) -> Dict[str, Any]:
+    columns: List[str] = []
+    for row in rows:
+        for key in row:
+            if key not in columns:
+                columns.append(key)
+    return {
+        "row_count": len(rows),
+        "columns": {
+            col: _describe_column(col, [row.get(col) for row in rows], histogram_size)
+            for col in columns
+        },
+        f"first_{top_rows}_rows": rows[:top_rows],
+        "note": f"Summary of {len(rows)} rows; aggregates cover every row.",
+    }
+
+
+def summarize_rows(rows: List[Dict[str, Any]], token_budget: int = EXPLAIN_ROWS_TOKEN_BUDGET) -> str:
+    """Rows as prompt text, reduced to a summary when they exceed the budget"""
+    full = json.dumps(rows, default=str)
+    full_tokens = _tokens(full)
+    if full_tokens <= token_budget or not rows or not isinstance(rows[0], dict):
+        stats.incr("passthrough")
+        return full
+
+    # shrink the sample and histograms until the summary fits
+    top_rows, histogram_size = MAX_TOP_ROWS, MAX_HISTOGRAM_VALUES
+    while True:
+        text = json.dumps(_summary(rows, top_rows, histogram_size), default=str)
+        if _tokens(text) <= token_budget or (top_rows == 0 and histogram_size == 0):
+            break
+        if top_rows > 0:
+            top_rows //= 2
+        else:
+            histogram_size //= 2
+
+    stats.incr("summarized")
+    stats.incr("tokens_saved", max(0, full_tokens - _tokens(text)))
+    return text
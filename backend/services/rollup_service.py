@@ -0,0 +1,186 @@
+"""
+Receipt Rollups
+Per-user spend pre-aggregated by day/month × category × merchant
+(`receipt_rollups_daily` / `receipt_rollups_monthly`, see models/schemas.sql).
+Saved receipts are added incrementally; readers (analysis context,
+dashboard summary) query the rollups instead of scanning `receipts`
+"""
+
+import datetime
+import os
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from services.metrics import get_stats
+from services.offload import run_blocking
+from services.query_service import execute_sql_async
+from services.supabase_client import supabase
+
+# Off: readers fall back to aggregating `receipts` directly (e.g. before the
+# rollup tables have been created and backfilled)
+RECEIPT_ROLLUPS_ENABLED = os.getenv("RECEIPT_ROLLUPS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+stats = get_stats("rollups")
+
+CATEGORY_SUMMARY_SQL = {
+    "rollup": """
+        SELECT
+            expense_category,
+            SUM(receipt_count) as transaction_count,
+            SUM(total_spent) as total_spent,
+            SUM(total_spent) / NULLIF(SUM(receipt_count), 0) as avg_amount,
+            MAX(day) as latest_date,
+            MIN(day) as earliest_date
+        FROM receipt_rollups_daily
+        WHERE user_id = '{user_id}'
+            AND day >= CURRENT_DATE - {days}
+        GROUP BY expense_category
+        ORDER BY total_spent DESC
+    """,
+    "receipts": """
+        SELECT
+            expense_category,
+            COUNT(*) as transaction_count,
+            SUM(total_amount) as total_spent,
+            AVG(total_amount) as avg_amount,
+            MAX(transaction_date) as latest_date,
+            MIN(transaction_date) as earliest_date
+        FROM receipts
+        WHERE user_id = '{user_id}'
+            AND transaction_date >= CURRENT_DATE - {days}
+        GROUP BY expense_category
+        ORDER BY total_spent DESC
+    """,
+}
+
+TOP_MERCHANTS_SQL = {
+    "rollup": """
+        SELECT
+            merchant_name,
+            SUM(receipt_count) as visit_count,
+            SUM(total_spent) as total_spent
+        FROM receipt_rollups_daily
+        WHERE user_id = '{user_id}'
+            AND day >= CURRENT_DATE - {days}
+        GROUP BY merchant_name
+        ORDER BY total_spent DESC
+        LIMIT {limit}
+    """,
+    "receipts": """
+        SELECT
+            merchant_name,
+            COUNT(*) as visit_count,
+            SUM(total_amount) as total_spent
+        FROM receipts
+        WHERE user_id = '{user_id}'
+            AND transaction_date >= CURRENT_DATE - {days}
+        GROUP BY merchant_name
+        ORDER BY total_spent DESC
+        LIMIT {limit}
+    """,
+}
+
+
+def _source() -> str:
+    return "rollup" if RECEIPT_ROLLUPS_ENABLED else "receipts"
+
+
+def _checked_user_id(user_id: str) -> str:
+    # interpolated into SQL below, so it has to be a real UUID
+    return str(uuid.UUID(str(user_id)))
+
+
+async def record_receipt(receipt: Dict[str, Any]):
+    """Add a freshly saved receipt to the user's daily and monthly rollups"""
+    if not RECEIPT_ROLLUPS_ENABLED or not receipt.get("transaction_date"):
+        return
+    params = {
+        "p_user_id": receipt["user_id"],
+        "p_transaction_date": receipt["transaction_date"],
+        "p_expense_category": receipt.get("expense_category"),
+        "p_merchant_name": receipt.get("merchant_name"),
+        "p_total_amount": receipt.get("total_amount"),
+    }
+    try:
+        await run_blocking("db", supabase.rpc("increment_receipt_rollups", params).execute)
+        stats.incr("increments")
+    except Exception as e:
+        # rollups are derived data: a rebuild repairs any drift, so a failure
+        # here must not fail the (already saved) receipt
+        stats.incr("increment_errors")
+        print(f"[Rollups] increment failed for receipt {receipt.get('id')}: {getattr(e, 'message', e)}")
+
+
+async def get_category_summary(user_id: str, days: int = 90) -> List[Dict[str, Any]]:
+    """Spend per category over the last `days` days"""
+    sql = CATEGORY_SUMMARY_SQL[_source()].format(user_id=_checked_user_id(user_id), days=int(days))
+    stats.incr(f"reads:{_source()}")
+    return await execute_sql_async(supabase, sql, user_id)
+
+
+async def get_top_merchants(user_id: str, days: int = 90, limit: int = 10) -> List[Dict[str, Any]]:
+    """Merchants by spend over the last `days` days"""
+    sql = TOP_MERCHANTS_SQL[_source()].format(
+        user_id=_checked_user_id(user_id), days=int(days), limit=int(limit)
+    )
+    stats.incr(f"reads:{_source()}")
+    return await execute_sql_async(supabase, sql, user_id)
+
+
+async def get_monthly_summary(user_id: str, months: int = 12) -> List[Dict[str, Any]]:
+    """
+    Per-month totals with a category breakdown, oldest month first.
+    A range read on the monthly rollup's primary key, or on `receipts`
+    when rollups are disabled.
+    """
+    today = datetime.date.today()
+    first = today.replace(day=1)
+    for _ in range(months - 1):
+        first = (first - datetime.timedelta(days=1)).replace(day=1)
+
+    if RECEIPT_ROLLUPS_ENABLED:
+        query = (
+            supabase.table("receipt_rollups_monthly")
+            .select("month, expense_category, receipt_count, total_spent")
+            .eq("user_id", user_id)
+            .gte("month", first.isoformat())
+            .order("month")
+        )
+    else:
+        query = (
+            supabase.table("receipts")
+            .select("transaction_date, expense_category, total_amount")
+            .eq("user_id", user_id)
+            .gte("transaction_date", first.isoformat())
+            .order("transaction_date")
+        )
+    try:
+        resp = await run_blocking("db", query.execute)
+    except Exception as e:
+        raise ValueError(f"Supabase select failed: {getattr(e, 'message', e)}") from e
+    stats.incr(f"reads:monthly:{_source()}")
+
+    summary: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    for row in resp.data or []:
+        if RECEIPT_ROLLUPS_ENABLED:
+            key, count, spent = row["month"], row["receipt_count"] or 0, float(row["total_spent"] or 0)
+        else:
+            key, count, spent = row["transaction_date"][:7] + "-01", 1, float(row["total_amount"] or 0)
+        month = summary.setdefault(
+            key,
+            {"month": key, "receipt_count": 0, "total_spent": 0.0, "categories": {}},
+        )
+        month["receipt_count"] += count
+        month["total_spent"] += spent
+        categories = month["categories"]
+        categories[row["expense_category"]] = categories.get(row["expense_category"], 0.0) + spent
+    return list(summary.values())
+
+
+def rebuild(user_id: Optional[str] = None) -> int:
+    """Recompute rollups from `receipts` (one user, or everyone); returns daily rows written"""
+    params = {"p_user_id": user_id} if user_id else {}
+    resp = supabase.rpc("rebuild_receipt_rollups", params).execute()
+    stats.incr("rebuilds")
+    return resp.data or 0
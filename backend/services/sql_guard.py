@@ -0,0 +1,189 @@
+"""
+SQL Guard
+Parses generated SQL into an AST before it reaches run_sql and rewrites it
+into a bounded, tenant-scoped, read-only query:
+- a single SELECT (or set operation of SELECTs); no DML/DDL/locking
+- only the receipt tables, each replaced by a subquery filtered to the
+  caller's user_id, so a missing or wrong predicate can't read other tenants
+  (CTEs may not reuse those table names)
+- every join needs a join condition; the number of joins is capped
+- a LIMIT is injected (or clamped) on the outer query
+Validated plans are cached with a user_id placeholder and reused across users.
+"""
+
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+
+from services.metrics import get_stats
+
+SQL_GUARD_MAX_ROWS = int(os.getenv("SQL_GUARD_MAX_ROWS", "500"))
+SQL_GUARD_MAX_JOINS = int(os.getenv("SQL_GUARD_MAX_JOINS", "3"))
+SQL_GUARD_CACHE_SIZE = int(os.getenv("SQL_GUARD_CACHE_SIZE", "2000"))
+
+USER_ID_PLACEHOLDER = "__GUARD_USER_ID__"
+UUID_LITERAL = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.IGNORECASE)
+
+# Readable tables and the tenant-scoped subquery each one is replaced with
+SCOPED_TABLES = {
+    "receipts": f"SELECT * FROM receipts WHERE user_id = '{USER_ID_PLACEHOLDER}'",
+    "receipt_items": (
+        "SELECT receipt_items.* FROM receipt_items "
+        "JOIN receipts ON receipt_items.receipt_id = receipts.id "
+        f"WHERE receipts.user_id = '{USER_ID_PLACEHOLDER}'"
+    ),
+}
+
+WRITE_NODES = tuple(
+    getattr(exp, name)
+    for name in (
+        "Insert", "Update", "Delete", "Merge", "Create", "Drop", "Alter", "AlterTable",
+        "TruncateTable", "Command", "Into", "Lock", "Set", "Grant", "Copy",
+    )
+    if hasattr(exp, name)
+)
+SET_OPERATIONS = (exp.Union, exp.Intersect, exp.Except)
+BLOCKED_FUNCTION_PREFIXES = ("pg_", "lo_", "dblink")
+BLOCKED_FUNCTIONS = {"set_config", "current_setting", "query_to_xml", "txid_current"}
+
+stats = get_stats("sql_guard")
+
+
+class UnsafeSQLError(ValueError):
+    """Generated SQL that may not be run"""
+
+
+def _reject(reason: str):
+    stats.incr("rejected")
+    stats.incr(f"rejected:{reason.split(':')[0]}")
+    raise UnsafeSQLError(reason)
+
+
+def _function_name(node: exp.Func) -> str:
+    if isinstance(node, exp.Anonymous):
+        return str(node.name).lower()
+    return node.sql_name().lower()
+
+
+def _scope_tables(tree: exp.Expression):
+    cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    # a CTE named like a scoped table would hide the real table from the
+    # skip below while its own body still reads it unscoped
+    shadowed = cte_names & set(SCOPED_TABLES)
+    if shadowed:
+        _reject(f"CTE shadows table: {', '.join(sorted(shadowed))}")
+    for table in list(tree.find_all(exp.Table)):
+        name = table.name.lower()
+        if name in cte_names and not table.args.get("db"):
+            continue
+        if name not in SCOPED_TABLES or (table.args.get("db") and table.text("db").lower() != "public"):
+            _reject(f"table not allowed: {table.sql(dialect='postgres')}")
+        scoped = exp.Subquery(
+            this=sqlglot.parse_one(SCOPED_TABLES[name], read="postgres"),
+            alias=exp.TableAlias(this=exp.to_identifier(table.alias_or_name)),
+        )
+        table.replace(scoped)
+
+
+def _check_joins(tree: exp.Expression):
+    joins = list(tree.find_all(exp.Join))
+    if len(joins) > SQL_GUARD_MAX_JOINS:
+        _reject(f"too many joins: {len(joins)}")
+    for join in joins:
+        if not (join.args.get("on") or join.args.get("using")):
+            _reject(f"unbounded join: {join.sql(dialect='postgres')}")
+
+
+def _apply_limit(tree: exp.Expression) -> exp.Expression:
+    limit = tree.args.get("limit")
+    if limit is not None:
+        value = limit.expression if isinstance(limit, exp.Limit) else None
+        if isinstance(value, exp.Literal) and value.is_int and int(value.this) <= SQL_GUARD_MAX_ROWS:
+            return tree
+        stats.incr("limits_clamped")
+    else:
+        stats.incr("limits_injected")
+    return tree.limit(SQL_GUARD_MAX_ROWS, copy=False)
+
+
+def build_plan(sql: str) -> str:
+    """Validate and rewrite SQL whose caller user_id is already the placeholder"""
+    try:
+        statements = [s for s in sqlglot.parse(sql, read="postgres") if s is not None]
+    except ParseError as e:
+        _reject(f"unparseable: {e}")
+    if len(statements) != 1:
+        _reject(f"expected one statement, got {len(statements)}")
+    tree = statements[0]
+
+    if not isinstance(tree, (exp.Select,) + SET_OPERATIONS):
+        _reject(f"not a SELECT: {tree.key}")
+    for node in tree.walk():
+        if isinstance(node, WRITE_NODES):
+            _reject(f"write or locking clause: {node.key}")
+        if isinstance(node, exp.Func):
+            name = _function_name(node)
+            if name in BLOCKED_FUNCTIONS or name.startswith(BLOCKED_FUNCTION_PREFIXES):
+                _reject(f"function not allowed: {name}")
+        if isinstance(node, exp.Literal) and node.is_string and UUID_LITERAL.search(node.this):
+            _reject("references another user_id")
+
+    _check_joins(tree)
+    _scope_tables(tree)
+    tree = _apply_limit(tree)
+    return tree.sql(dialect="postgres")
+
+
+class PlanCache:
+    """LRU of validated plans keyed by SQL with the caller's id templated out"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._plans: "OrderedDict[str, str]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+            return plan
+
+    def set(self, key: str, plan: str):
+        with self._lock:
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+
+
+plan_cache = PlanCache(SQL_GUARD_CACHE_SIZE)
+
+
+def guard_sql(sql: str, user_id: str) -> str:
+    """
+    The safe, rewritten form of `sql` for `user_id`.
+    Raises UnsafeSQLError when the SQL can't be made safe.
+    """
+    try:
+        user_id = str(uuid.UUID(str(user_id)))
+    except ValueError:
+        _reject("invalid user_id")
+    key = re.sub(re.escape(user_id), USER_ID_PLACEHOLDER, sql.strip().rstrip(";"), flags=re.IGNORECASE)
+
+    plan = plan_cache.get(key)
+    if plan is None:
+        stats.incr("plan_misses")
+        plan = build_plan(key)
+        plan_cache.set(key, plan)
+    else:
+        stats.incr("plan_hits")
+    stats.incr("guarded")
+    return plan.replace(USER_ID_PLACEHOLDER, user_id)
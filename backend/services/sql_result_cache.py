@@ -0,0 +1,119 @@
+"""
+SQL Result Cache
+Per-user cache of run_sql results keyed by (user_id, normalized SQL) and
+tied to a per-user data version that every receipt write bumps, so repeat
+questions are served locally until the user's data actually changes
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.metrics import get_stats
+
+SQL_RESULT_CACHE_ENABLED = os.getenv("SQL_RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+SQL_RESULT_CACHE_MAX_BYTES = int(os.getenv("SQL_RESULT_CACHE_MAX_MB", "64")) * 1024 * 1024
+# Versions live in this process only; the TTL bounds staleness for writes
+# that land on another worker
+SQL_RESULT_CACHE_TTL = int(os.getenv("SQL_RESULT_CACHE_TTL", "600"))
+# Larger results aren't worth the memory
+SQL_RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("SQL_RESULT_CACHE_MAX_ENTRY_KB", "512")) * 1024
+
+stats = get_stats("sql_result_cache")
+
+_QUOTED = re.compile(r"('(?:[^']|'')*')")
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace, drop a trailing ';' and lowercase outside literals"""
+    parts = _QUOTED.split(sql.strip().rstrip(";"))
+    return " ".join(
+        (p if i % 2 else " ".join(p.lower().split())) for i, p in enumerate(parts)
+    ).strip()
+
+
+class SQLResultCache:
+    def __init__(self, max_bytes: int, ttl: int):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # (user_id, sql) -> (data version, serialized rows, expires_at)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[int, str, float]]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._bytes = 0
+
+    def version(self, user_id: str) -> int:
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    def bump(self, user_id: str):
+        """Invalidate everything cached for the user"""
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+        stats.incr("invalidations")
+
+    def get(self, user_id: str, sql: str) -> Tuple[Optional[List[Dict[str, Any]]], int]:
+        """
+        (rows, version) on a hit, (None, version) on a miss. Pass the version
+        back to `set` so results read before a write are never stored as fresh.
+        """
+        key = (user_id, normalize_sql(sql))
+        now = time.time()
+        with self._lock:
+            version = self._versions.get(user_id, 0)
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] != version or entry[2] <= now):
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            self._record("misses")
+            return None, version
+        self._record("hits")
+        return json.loads(entry[1]), version
+
+    def set(self, user_id: str, sql: str, rows: List[Dict[str, Any]], version: int):
+        payload = json.dumps(rows, default=str)
+        if len(payload) > SQL_RESULT_CACHE_MAX_ENTRY_BYTES:
+            stats.incr("too_large")
+            return
+        key = (user_id, normalize_sql(sql))
+        with self._lock:
+            if self._versions.get(user_id, 0) != version:
+                return  # the user's data changed while the query ran
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, payload, time.time() + self.ttl)
+            self._bytes += len(key[1]) + len(payload)
+            while self._bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                stats.incr("evictions")
+            stats.set("memory_bytes", self._bytes)
+            stats.set("entries", len(self._entries))
+
+    def _remove(self, key: Tuple[str, str]):
+        _, payload, _ = self._entries.pop(key)
+        self._bytes -= len(key[1]) + len(payload)
+
+    def _record(self, outcome: str):
+        stats.incr(outcome)
+        stats.incr("lookups")
+        stats.set("hit_ratio", stats.ratio("hits", "lookups"))
+
+
+sql_result_cache = (
+    SQLResultCache(SQL_RESULT_CACHE_MAX_BYTES, SQL_RESULT_CACHE_TTL)
+    if SQL_RESULT_CACHE_ENABLED
+    else None
+)
+
+
+def invalidate_user(user_id: str):
+    """Call after any write to the user's receipts or receipt items"""
+    if sql_result_cache is not None:
+        sql_result_cache.bump(str(user_id))
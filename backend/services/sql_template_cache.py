@@ -0,0 +1,131 @@
+"""
+NL → SQL Template Cache
+Generated SQL only differs between users in the user_id literal, so it is
+stored once per normalized question as a template with a user_id
+placeholder and shared across users
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from prompts.prompts import SQLCODER_PROMPT_TEMPLATE
+from services.metrics import get_stats
+
+SQL_TEMPLATE_CACHE_ENABLED = os.getenv("SQL_TEMPLATE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+SQL_TEMPLATE_CACHE_MAX_ENTRIES = int(os.getenv("SQL_TEMPLATE_CACHE_MAX_ENTRIES", "5000"))
+SQL_TEMPLATE_CACHE_TTL = int(os.getenv("SQL_TEMPLATE_CACHE_TTL", str(24 * 3600)))
+
+# Cached SQL is only valid for the schema SQLCoder was prompted with: the
+# version changes with the prompt template (which carries the schema) and
+# can be bumped by hand after a migration the prompt doesn't show
+SCHEMA_VERSION = hashlib.sha256(
+    (SQLCODER_PROMPT_TEMPLATE + os.getenv("SQL_TEMPLATE_CACHE_VERSION", "")).encode("utf-8")
+).hexdigest()[:16]
+
+USER_ID_PLACEHOLDER = "__USER_ID__"
+DATE_LITERAL = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# Equivalent spellings of relative-date phrases
+RELATIVE_DATE_SYNONYMS = [
+    (re.compile(r"\b(?:past|previous|prior)\s+(?=\d+\s+(?:day|week|month|year)s?\b)"), "last "),
+    (re.compile(r"\b(?:the\s+)?(?:previous|prior)\s+(day|week|month|year)\b"), r"last \1"),
+    (re.compile(r"\b(?:the\s+)?(?:current|present)\s+(week|month|year)\b"), r"this \1"),
+    (re.compile(r"\bthe\s+(last|this)\s+"), r"\1 "),
+    (re.compile(r"\b(\d+)\s+(day|week|month|year)\b(?!s)"), r"\1 \2s"),
+    (re.compile(r"\blast\s+1\s+(day|week|month|year)s\b"), r"last \1"),
+    (re.compile(r"\bthis\s+past\s+"), "last "),
+    (re.compile(r"\blast\s+day\b"), "yesterday"),
+]
+
+stats = get_stats("sql_template_cache")
+
+
+def normalize_question(question: str) -> str:
+    """Case, whitespace, trailing punctuation and relative-date phrasing"""
+    text = " ".join(question.lower().split()).rstrip("?!. ")
+    for pattern, replacement in RELATIVE_DATE_SYNONYMS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class SQLTemplateCache:
+    def __init__(self, max_entries: int, ttl: int, schema_version: str):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.schema_version = schema_version
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+
+    def _key(self, question: str) -> Tuple[str, str]:
+        return self.schema_version, normalize_question(question)
+
+    def get(self, question: str, user_id: str) -> Optional[str]:
+        """SQL for `user_id` from a cached template, or None"""
+        try:
+            user_id = str(uuid.UUID(str(user_id)))
+        except ValueError:
+            return None
+        key = self._key(question)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            self._record("misses")
+            return None
+        self._record("hits")
+        # user_id is a canonical UUID, so it can't break out of the quotes
+        return entry[0].replace(USER_ID_PLACEHOLDER, user_id)
+
+    def set(self, question: str, user_id: str, sql: str):
+        template = self.make_template(question, user_id, sql)
+        if template is None:
+            stats.incr("rejected")
+            return
+        key = self._key(question)
+        with self._lock:
+            self._entries[key] = (template, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                stats.incr("evictions")
+            stats.set("entries", len(self._entries))
+
+    @staticmethod
+    def make_template(question: str, user_id: str, sql: str) -> Optional[str]:
+        """
+        The SQL with the caller's id replaced by the placeholder, or None when
+        it isn't safe to share: no user filter, another user's id, the
+        placeholder text itself, or dates resolved from a relative phrase
+        """
+        user_id = str(user_id).lower()
+        lowered = sql.lower()
+        if f"'{user_id}'" not in lowered or USER_ID_PLACEHOLDER.lower() in lowered:
+            return None
+        template = re.sub(re.escape(f"'{user_id}'"), f"'{USER_ID_PLACEHOLDER}'", sql, flags=re.IGNORECASE)
+        if re.search(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", template, re.IGNORECASE):
+            return None
+        if any(d not in question for d in DATE_LITERAL.findall(template)):
+            return None
+        return template
+
+    def _record(self, outcome: str):
+        stats.incr(outcome)
+        stats.set("hit_ratio", stats.get("hits") / ((stats.get("hits") + stats.get("misses")) or 1))
+
+
+sql_template_cache = (
+    SQLTemplateCache(SQL_TEMPLATE_CACHE_MAX_ENTRIES, SQL_TEMPLATE_CACHE_TTL, SCHEMA_VERSION)
+    if SQL_TEMPLATE_CACHE_ENABLED
+    else None
+)
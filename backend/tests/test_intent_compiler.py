@@ -0,0 +1,43 @@
+import pytest
+
+from services.intent_compiler import compile_question, parse
+
+USER_ID = "00000000-0000-4000-8000-000000000001"
+
+
+@pytest.mark.parametrize(
+    "question, intent, merchant",
+    [
+        ("how much did I spend at walmart last month", "total", "walmart"),
+        ("list receipts from target", "list", "target"),
+        ("list receipts from amazon.com", "list", "amazon.com"),
+    ],
+)
+def test_merchant_slot(question, intent, merchant):
+    parsed = parse(question)
+    assert parsed is not None
+    assert parsed[0] == intent
+    assert parsed[1]["merchant"] == merchant
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "show me receipts from my trip to paris",
+        "how much did I spend at the home depot and lowes",
+        "what is my average spend per week",
+        "how much did I spend\nlast month",
+        "how much did I spend at target including tax",
+        "show receipts from may",
+    ],
+)
+def test_falls_back_to_sqlcoder(question):
+    assert parse(question) is None
+    assert compile_question(question, USER_ID) is None
+
+
+def test_from_year_is_a_date_not_a_merchant():
+    intent, slots = parse("show my receipts from 2024")
+    assert intent == "list"
+    assert slots["merchant"] is None
+    assert slots["date"][0] == "make_date(2024, 1, 1)"
@@ -0,0 +1,36 @@
+import io
+
+from PIL import Image
+
+from services.ocr_service import OCR_MAX_DIMENSION, preprocess_for_tesseract
+
+
+def _jpeg(size, orientation=None) -> bytes:
+    image = Image.new("RGB", size, "white")
+    buf = io.BytesIO()
+    if orientation is None:
+        image.save(buf, format="JPEG")
+    else:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        image.save(buf, format="JPEG", exif=exif)
+    return buf.getvalue()
+
+
+def test_caps_long_side():
+    image = preprocess_for_tesseract(_jpeg((3024, 4032)))
+    assert max(image.size) == OCR_MAX_DIMENSION
+    assert image.size[0] < image.size[1]
+
+
+def test_exif_rotated_portrait_fills_the_cap():
+    # stored landscape, displayed portrait (rotate 90 CW), as phones save it
+    image = preprocess_for_tesseract(_jpeg((4032, 3024), orientation=6))
+    assert image.size[0] < image.size[1]
+    assert max(image.size) == OCR_MAX_DIMENSION
+    assert image.size == (OCR_MAX_DIMENSION * 3 // 4, OCR_MAX_DIMENSION)
+
+
+def test_small_images_are_not_upscaled():
+    image = preprocess_for_tesseract(_jpeg((800, 600), orientation=6))
+    assert image.size == (600, 800)
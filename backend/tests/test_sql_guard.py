@@ -0,0 +1,30 @@
+import pytest
+
+from services.sql_guard import UnsafeSQLError, guard_sql
+
+USER_ID = "00000000-0000-4000-8000-000000000001"
+
+
+def test_scopes_receipts_to_user():
+    sql = guard_sql("SELECT SUM(total_amount) FROM receipts", USER_ID)
+    assert f"user_id = '{USER_ID}'" in sql
+    assert "LIMIT" in sql
+
+
+def test_scopes_tables_inside_cte_bodies():
+    sql = guard_sql("WITH r AS (SELECT * FROM receipts) SELECT COUNT(*) FROM r", USER_ID)
+    assert f"user_id = '{USER_ID}'" in sql
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "WITH receipts AS (SELECT * FROM receipts) SELECT * FROM receipts",
+        "WITH receipt_items AS (SELECT * FROM receipt_items) SELECT * FROM receipt_items",
+        "DELETE FROM receipts",
+        "SELECT * FROM users",
+    ],
+)
+def test_rejects_unsafe_sql(query):
+    with pytest.raises(UnsafeSQLError):
+        guard_sql(query, USER_ID)